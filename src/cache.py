@@ -0,0 +1,60 @@
+import hashlib
+import json
+import os
+import pickle
+from functools import lru_cache
+
+from sweep import SWEEP_PARAMS
+
+# args that do not change the results (the sweep values are part of the task key instead)
+IGNORED_ARGS = {'dpath', 'spath', 'id', 'workers', 'points', 'cache', 'nocache', 'format', 'seed'} | set(SWEEP_PARAMS['WI'])
+# args a mode does not read
+UNUSED_ARGS = {'NI': {'tmod', 'eps', 'df', 'mmod', 'nscore', 'online'},
+               'WT': {'mmod', 'nscore', 'online'},
+               'WI': {'batch'}}
+
+
+@lru_cache(maxsize=None)
+def dataset_hash(path):
+    ''' sha256 of the dataset file '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def config_hash(args):
+    ''' sha256 of the args that the results of the mode depend on '''
+    config = {k:v for k,v in sorted(vars(args).items()) if k not in IGNORED_ARGS | UNUSED_ARGS[args.mode]}
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+def cell_path(args, path, *key):
+    '''
+    input:
+        - path: dataset file
+        - key: the task key (e.g., dataset, parameter values, source set), as given to parallel.seed_task
+    output:
+        - file that caches the result of the task: args.cache/<h[:2]>/<h>.pkl with h the hash of
+          (dataset hash, config hash, task key, seed), None if the cache is off
+    '''
+    if args.nocache:
+        return None
+    cell = json.dumps([dataset_hash(path), config_hash(args), [str(k) for k in key], str(args.seed)])
+    h = hashlib.sha256(cell.encode()).hexdigest()
+    return os.path.join(args.cache, h[:2], h + '.pkl')
+
+
+def load_cell(cell):
+    with open(cell, 'rb') as f:
+        return pickle.load(f)
+
+
+def save_cell(cell, result):
+    ''' written to a temporary file first, a killed run never leaves a partial cell behind '''
+    os.makedirs(os.path.dirname(cell), exist_ok=True)
+    tmp = f'{cell}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(result, f)
+    os.replace(tmp, cell)
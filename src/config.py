@@ -5,11 +5,11 @@ Multi-value parameters:
     - tcer
     - mcbud
     - mnbud
+    - mrd
     - cthr
-The run.py is written with the assumption that at each run only one of
-these parameters is multi-value (i.e., len(args.<parameter>) > 1).
-If you wish to have several of them as multi-value, you have to change run.py
-accordingly.
+Each run sweeps the full grid of the values of the multi-value parameters (or the points
+listed in the --points file), one result file per point, see sweep.py. The file of each
+point is listed in spath/<mode dir>/<id>_index.json.
 '''
 
 import argparse
@@ -30,6 +30,32 @@ def get_args():
                             help='The mode of running the code. NI: no intervestion (e.g. just SIR) || \
                                      WT: with test || WI: with intervention (test + mitigation)')
     parser.add_argument('--sd', type=int, default=200, help='Simulation duration.')
+    parser.add_argument('--reps', type=int, default=1,
+                            help='Number of Monte-Carlo repeats of the simulation for each source set.')
+    parser.add_argument('--points', type=str, default=None,
+                            help='JSON file with the list of parameter points to run instead of the full grid, \
+                                  e.g. [{"mcbud": 0.01, "mrd": 3}, {"mcbud": 0.02, "tbud": 0.2}]. The parameters \
+                                  a point leaves out take their first value.')
+    parser.add_argument('--workers', type=int, default=1,
+                            help='Number of processes that the (dataset, parameter value, source set) \
+                                  tasks are spread over. The results are saved in the same order and layout.')
+    parser.add_argument('--format', type=str, default='pkl', choices=['pkl', 'chunked'],
+                            help='Format of the result files. pkl: one pickle of the whole output, saved at \
+                                  the end || chunked: a results.ResultWriter directory that each source \
+                                  set is appended to as soon as it is done, with the graph saved once per dataset.')
+    parser.add_argument('--cache', type=str, default=None,
+                            help='The directory to cache the result of each (dataset, parameter values, \
+                                  source set, seed) task in, spath/cache if not given. The tasks found \
+                                  there are not run again, so a killed run resumes where it stopped.')
+    parser.add_argument('--nocache', action='store_true',
+                            help='Do not cache the results of the tasks.')
+    parser.add_argument('--seed', type=int, default=0,
+                            help='Base seed of the runs. Each task is seeded from it and its dataset, parameter \
+                                  values and source set, so the results do not depend on --workers, and a rerun with \
+                                  the same seed finds its tasks in --cache.')
+    parser.add_argument('--batch', action='store_true',
+                            help='Simulate all the source sets (and their repeats) together as replicas of \
+                                  one ensemble spread model. Used in NI and WT modes.')
 
     # --------- contagion (spread) prameters
     parser.add_argument('--cmod', type=str, default='SIS', choices=['SIR', 'SIS'],
@@ -38,6 +64,13 @@ def get_args():
                             help='Infection rate for SIR or SIS contagion model.')
     parser.add_argument('--doi', type=int, default=3, 
                             help='Duration of infection for SIR or SIS contagion model.')
+    parser.add_argument('--engine', type=str, default='nx', choices=['nx', 'csr', 'event'],
+                            help='Spread simulation engine. nx: node by node over the networkx graph || \
+                                  csr: batched numpy operations over the CSR adjacency of the graph || \
+                                  event: continuous-time event queue sampled at every timestamp. \
+                                  nx and csr run the same discrete-time model. event is a different model \
+                                  (an infection can chain through several hops within one unit of time), \
+                                  so its results are not comparable with theirs.')
 
     # -------- test parameters
     parser.add_argument('--tmod', type=str, default='epsilon_greedy', choices=['random', 'random_with_memory',\
@@ -80,7 +113,19 @@ def get_args():
                             help='The list of thresholds for comiso method in terms of the proportion of \
                                   the community size. The values are in (0,1) range.')
 
+    parser.add_argument('--nscore', type=str, default='B', choices=['A', 'B', 'C'],
+                            help='Node score variant of commit. A: known degree || \
+                                  B: community score || \
+                                  C: mean of community score and neighborhood connectivity.')
+
+    parser.add_argument('--online', action='store_true',
+                            help='Detect the communities of commit and comiso online on the known graph \
+                                  (refined by local moves as tracing reveals edges) instead of using \
+                                  the communities of the dataset.')
+
     args = parser.parse_args()
+    if args.cache is None:
+        args.cache = os.path.join(args.spath, 'cache')
     if not os.path.exists(args.spath):
         os.makedirs(args.spath)
     return args
\ No newline at end of file
@@ -4,19 +4,22 @@ TODO
     - check if #recovered in plots makes sense
 '''
 
+import heapq
 import numpy as np
-from collections import Counter
 import matplotlib.pyplot as plt
 
+from graph_state import GraphState, RestrictionOverlay
+from history import SpreadHistory, STATE_NAMES, STATE_CODES
+
 class ContagionModel():
     def __init__(self, graph, states, model, duration_infectious, infection_rate):
-        self.graph = graph.copy()  # networkx graph, graph_u
+        self.graph = graph  # networkx graph, graph_u. Read-only, shared with the other components
         self.model = model  # string, SIR, SIRD, SIS
         self.duration = duration_infectious  # duration of infected after which it is recovered
         self.inf_rate = infection_rate  # probability of S -> I if S a neighbor of I
         self.states = states  # {node:state}
-        self.history = [self.states.copy()]  # list of node states for each time "run" is called 
-        self.track_inf = {k:1 for k,v in self.history[0].items() if v == 'I'}  # {infected_node:duration_of_its_infection}
+        self.history = SpreadHistory(list(self.states), self.states)  # node states for each time "run" is called, see history.SpreadHistory
+        self.track_inf = {k:1 for k,v in self.states.items() if v == 'I'}  # {infected_node:duration_of_its_infection}
         self.terminate = False
         
         
@@ -42,7 +45,7 @@ class ContagionModel():
         ### check for termination ###
         if len(self.track_inf) == 0:
             # update history
-            self.history.append(self.states.copy())
+            self.history.record_states(recovered)
             self.terminate = True
             return 
 
@@ -58,7 +61,7 @@ class ContagionModel():
         self.track_inf.update({k:1 for k in infected})
 
         # update history
-        self.history.append(self.states.copy())
+        self.history.record_states({**recovered, **infected})
 
     def SIS(self):
         ### recovered I -> S ###
@@ -73,7 +76,7 @@ class ContagionModel():
         ### check for termination ###
         if len(self.track_inf) == 0:
             # update history
-            self.history.append(self.states.copy())
+            self.history.record_states(recovered)
             self.terminate = True
             return 
 
@@ -89,7 +92,7 @@ class ContagionModel():
         self.track_inf.update({k:1 for k in infected})
 
         # update history
-        self.history.append(self.states.copy())
+        self.history.record_states({**recovered, **infected})
    
     def get_settings(self):
         return dict(graph = self.graph, model = self.model, duration = self.duration,
@@ -98,6 +101,9 @@ class ContagionModel():
     def get_states(self):
         return self.states
 
+    def get_node_states(self, nodes):
+        return [self.states[k] for k in nodes]
+
     def get_history(self):
         return self.history
 
@@ -111,14 +117,9 @@ class ContagionModel():
         if self.model == 'SIR':
             x = range(len(self.history))
             size = self.graph.number_of_nodes()
-            num_inf = []
-            num_sus = []
-            num_rec = []
-            for idx in x:
-                counts = dict(Counter(self.history[idx].values()))
-                num_inf.append(counts.pop('I', 0)/size)
-                num_sus.append(counts.pop('S', 0)/size)
-                num_rec.append(counts.pop('R', 0)/size)
+            num_inf = self.history.counts('I')/size
+            num_sus = self.history.counts('S')/size
+            num_rec = self.history.counts('R')/size
             plt.figure(figsize=(10,5))
             plt.plot(x, num_inf, label = 'infected')
             # plt.plot(x, num_sus, label = 'susceptible')
@@ -131,12 +132,8 @@ class ContagionModel():
         elif self.model == 'SIS':
             x = range(len(self.history))
             size = self.graph.number_of_nodes()
-            num_inf = []
-            num_sus = []
-            for idx in x:
-                counts = dict(Counter(self.history[idx].values()))
-                num_inf.append(counts.pop('I', 0)/size)
-                num_sus.append(counts.pop('S', 0)/size)
+            num_inf = self.history.counts('I')/size
+            num_sus = self.history.counts('S')/size
             plt.figure(figsize=(10,5))
             plt.plot(x, num_inf, label = 'infected')
             plt.plot(x, num_sus, label = 'susceptible')
@@ -147,4 +144,346 @@ class ContagionModel():
             
         else:
             raise ValueError(f'The model {self.model} is not supported.')
-    
\ No newline at end of file
+
+
+class CSRContagionModel(ContagionModel):
+    '''
+    Same SIR/SIS process as ContagionModel, but node states and infection timers are numpy
+    arrays over the CSR adjacency of the graph. Recovery and S -> I transmission are done for
+    the whole infected frontier with a few array operations per step.
+    Transmission uses one of two kernels (same outcome distribution):
+        push: one trial for every (infected, neighbor) adjacency slot
+        pull: count the infected neighbors k of every node with a sparse matrix-vector product
+              and infect each susceptible node with probability 1-(1-inf_rate)^k
+    With kernel='auto', like direction-optimizing BFS, the kernel is chosen at every step:
+    pull once the infected nodes hold more than 1/pull_alpha of the adjacency slots.
+    '''
+    def __init__(self, graph, states, model, duration_infectious, infection_rate,
+                 kernel='auto', pull_alpha=30):
+        self.kernel = kernel  # push, pull, auto
+        self.pull_alpha = pull_alpha
+        self.topo = None
+        self.set_graph(graph)  # sets self.topo (GraphState), self.mask and self.graph
+        self.model = model  # string, SIR, SIS
+        self.duration = duration_infectious  # duration of infected after which it is recovered
+        self.inf_rate = infection_rate  # probability of S -> I if S a neighbor of I
+        self.state = np.asarray([STATE_CODES[states[n]] for n in self.topo.nodes.tolist()],
+                                dtype=np.int8)  # {node_index: state_code}
+        self.timer = np.where(self.state == STATE_CODES['I'], 1, 0)  # {node_index: duration_of_its_infection}, 0 if not infected
+        self.history = SpreadHistory(self.topo.nodes, self.state)  # node states for each time "run" is called
+        self.terminate = False
+
+    def SIR(self):
+        self.step(STATE_CODES['R'])
+
+    def SIS(self):
+        self.step(STATE_CODES['S'])
+
+    def step(self, recovered_state):
+        ### Recovery I -> R (SIR) or I -> S (SIS) ###
+        recovered = (self.timer > 0) & (self.timer >= self.duration)
+        self.state[recovered] = recovered_state
+        self.timer[recovered] = 0
+        infected = self.timer > 0
+        self.timer[infected] += 1  # for next timestamp
+
+        ### check for termination ###
+        if not infected.any():
+            self.update_history()
+            self.terminate = True
+            return
+
+        ### Infection S -> I ###
+        if self.use_pull(self.topo.degree()[infected].sum()):
+            infected = self.pull(infected)
+        else:
+            infected = self.push(infected)
+        self.state[infected] = STATE_CODES['I']
+        self.timer[infected] = 1
+
+        self.update_history()
+
+    def use_pull(self, frontier_slots):
+        if self.kernel == 'auto':
+            return frontier_slots * self.pull_alpha > len(self.topo.indices)
+        return self.kernel == 'pull'
+
+    def push(self, infected):
+        # one trial per (infected, neighbor) adjacency slot
+        _, slots = self.topo.expand(np.flatnonzero(infected))
+        if self.mask is not None:
+            slots = slots[self.mask[self.topo.eid[slots]]]
+        targets = self.topo.indices[slots]
+        success = (self.state[targets] == STATE_CODES['S']) & \
+                    (np.random.random(len(targets)) <= self.inf_rate)
+        return np.unique(targets[success])
+
+    def pull(self, infected):
+        # one trial per susceptible node with k infected neighbors
+        num_inf = self.topo.adjacency(self.mask) @ infected.astype(np.int32)
+        exposed = np.flatnonzero((self.state == STATE_CODES['S']) & (num_inf > 0))
+        prob = 1 - (1 - self.inf_rate) ** num_inf[exposed]
+        return exposed[np.random.random(len(exposed)) < prob]
+
+    def update_history(self):
+        self.history.record_array(self.state)
+
+    def get_states(self):
+        return dict(zip(self.topo.nodes.tolist(), STATE_NAMES[self.state].tolist()))
+
+    def get_node_states(self, nodes):
+        return STATE_NAMES[self.state[[self.topo.index[k] for k in nodes]]].tolist()
+
+    def set_graph(self, g):
+        self.mask = None  # {edge_id: not cut}, read directly from the restrictions if g is a RestrictionOverlay
+        if isinstance(g, RestrictionOverlay):
+            self.topo = g.topo
+            self.mask = g.edge_mask
+        elif isinstance(g, GraphState):
+            self.topo = g
+        elif self.topo is None:
+            self.topo = GraphState(g)
+        else:  # keep the node indices of the current topology
+            self.topo = GraphState(g, nodelist=self.topo.nodes.tolist())
+        self.graph = g
+
+
+class EventContagionModel(ContagionModel):
+    '''
+    Continuous-time, event-driven version of the SIR/SIS process.
+    Infection and recovery events are kept in a priority queue (heap) and each call of "run"
+    processes the events in (t, t+1] and records the states at t+1, so the history has the
+    same format as the discrete-time models and the cost scales with the number of events.
+    An infected node recovers duration_infectious after its infection. Until one unit of time
+    before that (in the discrete models a node recovers before transmitting in its last step)
+    it transmits over each edge as a Poisson process with rate -ln(1-infection_rate), i.e. the
+    same per unit of time (and per infection) transmission probability as the discrete models.
+    A transmission that hits a non-susceptible node or a removed edge is rescheduled.
+    This is not the discrete-time model of the other engines: a node infected within a step
+    transmits in the same step, so the infection can chain through several hops per unit of
+    time, and the results are not comparable with those of the discrete engines.
+    '''
+    RECOVER = 0
+    TRANSMIT = 1
+
+    def __init__(self, graph, states, model, duration_infectious, infection_rate):
+        self.mask = None
+        if isinstance(graph, RestrictionOverlay):
+            self.topo = graph.topo  # all the edges events can use
+            self.set_graph(graph)
+        else:
+            self.topo = graph if isinstance(graph, GraphState) else GraphState(graph)
+            self.graph = graph  # current graph, transmissions over removed edges fail
+        self.model = model  # string, SIR, SIS
+        self.duration = duration_infectious  # duration of infected after which it is recovered
+        self.inf_rate = infection_rate  # probability of S -> I if S a neighbor of I
+        self.time = 0
+        self.events = []  # heap of (time, seq, kind, node_index, adjacency_slot)
+        self.seq = 0  # tie breaker for events at the same time
+        self.state = np.asarray([STATE_CODES[states[n]] for n in self.topo.nodes.tolist()],
+                                dtype=np.int8)  # {node_index: state_code}
+        self.recovery = np.zeros(len(self.state))  # {node_index: time of recovery of its current infection}
+        self.contagious = np.zeros(len(self.state))  # {node_index: end of transmissions of its current infection}
+        self.delay_pool = []  # pre-drawn waiting times, see delay()
+        self.labels = self.topo.nodes.tolist()  # {node_index: node}
+        self.num_inf = 0
+        self.history = SpreadHistory(self.topo.nodes, self.state)  # node states for each time "run" is called
+        self.touched = []  # node indices whose state changed in the current "run"
+        self.terminate = False
+        for v in np.flatnonzero(self.state == STATE_CODES['I']):
+            self.infect(v, 0.)
+        self.touched = []
+
+    def run(self):
+        if self.model not in ('SIR', 'SIS'):
+            raise ValueError(f'The contagion model {self.model} is not supported.')
+        self.time += 1
+        while self.events and self.events[0][0] <= self.time:
+            t, _, kind, v, slot = heapq.heappop(self.events)
+            if kind == self.RECOVER:
+                self.recover(v)
+            else:
+                self.transmit(t, v, slot)
+        self.history.record(self.touched, self.state[self.touched])
+        self.touched = []
+        if self.num_inf == 0:
+            self.terminate = True
+
+    def push_event(self, t, kind, v, slot=-1):
+        heapq.heappush(self.events, (t, self.seq, kind, v, slot))
+        self.seq += 1
+
+    def infect(self, v, t):
+        self.state[v] = STATE_CODES['I']
+        self.touched.append(v)
+        self.num_inf += 1
+        self.recovery[v] = t + self.duration
+        self.contagious[v] = self.recovery[v] - 1
+        self.push_event(self.recovery[v], self.RECOVER, v)
+        # first transmission attempt over each edge, if it is still contagious then
+        for slot in range(self.topo.indptr[v], self.topo.indptr[v+1]):
+            t_u = t + self.delay()
+            if t_u < self.contagious[v]:
+                self.push_event(t_u, self.TRANSMIT, v, slot)
+
+    def recover(self, v):
+        self.state[v] = STATE_CODES['R'] if self.model == 'SIR' else STATE_CODES['S']
+        self.touched.append(v)
+        self.num_inf -= 1
+
+    def transmit(self, t, v, slot):
+        u = self.topo.indices[slot]
+        if self.state[u] == STATE_CODES['S'] and self.edge_exists(v, slot):
+            self.infect(u, t)
+            return
+        # try again later (memoryless)
+        if self.state[u] == STATE_CODES['R'] or (self.state[u] == STATE_CODES['I'] and self.model == 'SIR'):
+            return  # u is never susceptible again
+        if self.state[u] == STATE_CODES['I']:
+            t = max(t, self.recovery[u]) + self.delay()  # no use in trying before u is susceptible again
+        else:  # the edge is removed, the restrictions only change between two calls of "run"
+            t = self.time + self.delay()
+            if t <= self.time:  # inf_rate >= 1, never retry within the current step
+                t = self.time + 1
+        if t < self.contagious[v]:
+            self.push_event(t, self.TRANSMIT, v, slot)
+
+    def delay(self):
+        # waiting time of a Poisson process with rate -ln(1-inf_rate), drawn in chunks
+        if self.inf_rate >= 1:
+            return 0.
+        if len(self.delay_pool) == 0:
+            self.delay_pool = np.random.exponential(-1/np.log(1 - self.inf_rate), 4096).tolist()
+        return self.delay_pool.pop()
+
+    def edge_exists(self, v, slot):
+        if self.mask is not None:
+            return self.mask[self.topo.eid[slot]]
+        if self.graph is self.topo or self.graph is self.topo.nx_graph:
+            return True
+        return self.graph.has_edge(self.labels[v], self.labels[self.topo.indices[slot]])
+
+    def get_states(self):
+        return dict(zip(self.labels, STATE_NAMES[self.state].tolist()))
+
+    def get_node_states(self, nodes):
+        return STATE_NAMES[self.state[[self.topo.index[k] for k in nodes]]].tolist()
+
+    def set_graph(self, g):
+        if isinstance(g, RestrictionOverlay):  # read the restrictions directly
+            self.mask = g.edge_mask
+            self.graph = g
+        else:
+            self.mask = None
+            self.graph = g
+
+
+class EnsembleContagionModel():
+    '''
+    Independent realizations (replicas) of the CSRContagionModel process advanced together.
+    Node states and infection timers are (replicas x nodes) matrices, so a step does recovery
+    and S -> I transmission for the infected frontier of every replica at once.
+    Each replica keeps its own history (SpreadHistory) which stops growing once it terminates.
+    The push/pull kernels and their switching are the same as in CSRContagionModel, the pull
+    kernel is a sparse matrix-matrix product over all the replicas.
+    '''
+    def __init__(self, graph, states, model, duration_infectious, infection_rate,
+                 kernel='auto', pull_alpha=30):
+        self.kernel = kernel  # push, pull, auto
+        self.pull_alpha = pull_alpha
+        self.topo = graph if isinstance(graph, GraphState) else GraphState(graph)
+        self.graph = graph
+        self.model = model  # string, SIR, SIS
+        self.duration = duration_infectious  # duration of infected after which it is recovered
+        self.inf_rate = infection_rate  # probability of S -> I if S a neighbor of I
+        nodes = self.topo.nodes.tolist()
+        self.state = np.asarray([[STATE_CODES[st[n]] for n in nodes] for st in states],
+                                dtype=np.int8).reshape(len(states), len(nodes))  # {(replica, node_index): state_code}
+        self.timer = np.where(self.state == STATE_CODES['I'], 1, 0)  # {(replica, node_index): duration_of_its_infection}
+        self.history = [SpreadHistory(self.topo.nodes, st) for st in self.state]  # [SpreadHistory of each replica]
+        self.active = np.ones(len(states), dtype=bool)  # replicas not terminated yet
+        self.terminate = len(states) == 0
+
+    def run(self):
+        if self.model == 'SIR':
+            self.step(STATE_CODES['R'])
+        elif self.model == 'SIS':
+            self.step(STATE_CODES['S'])
+        else:
+            raise ValueError(f'The contagion model {self.model} is not supported.')
+
+    def step(self, recovered_state):
+        ### Recovery I -> R (SIR) or I -> S (SIS) ###
+        recovered = (self.timer > 0) & (self.timer >= self.duration)
+        self.state[recovered] = recovered_state
+        self.timer[recovered] = 0
+        infected = self.timer > 0
+        self.timer[infected] += 1  # for next timestamp
+
+        ### Infection S -> I ###
+        frontier_slots = (infected * self.topo.degree()).sum()
+        if self.kernel == 'pull' or (self.kernel == 'auto' and \
+                frontier_slots * self.pull_alpha > len(self.topo.indices) * len(self.state)):
+            rep, node = self.pull(infected)
+        else:
+            rep, node = self.push(infected)
+        self.state[rep, node] = STATE_CODES['I']
+        self.timer[rep, node] = 1
+
+        ### update history and check for termination ###
+        for r in np.flatnonzero(self.active):
+            self.history[r].record_array(self.state[r])
+        self.active &= infected.any(axis=1)
+        self.terminate = not self.active.any()
+
+    def push(self, infected):
+        # one trial per (replica, infected, neighbor)
+        rep, node = np.nonzero(infected)
+        owner, slots = self.topo.expand(node)
+        rep = rep[owner]
+        targets = self.topo.indices[slots]
+        success = (self.state[rep, targets] == STATE_CODES['S']) & \
+                    (np.random.random(len(targets)) <= self.inf_rate)
+        return rep[success], targets[success]
+
+    def pull(self, infected):
+        # one trial per (replica, susceptible node with k infected neighbors)
+        num_inf = (self.topo.adjacency() @ infected.T.astype(np.int32)).T
+        rep, node = np.nonzero((self.state == STATE_CODES['S']) & (num_inf > 0))
+        prob = 1 - (1 - self.inf_rate) ** num_inf[rep, node]
+        success = np.random.random(len(rep)) < prob
+        return rep[success], node[success]
+
+    def get_history(self, replica):
+        return self.history[replica]
+
+    def get_states(self, replica):
+        return dict(zip(self.topo.nodes.tolist(), STATE_NAMES[self.state[replica]].tolist()))
+
+
+class ReplayContagionModel():
+    '''
+    Steps through an already simulated spread history one "run" at a time, e.g. to run a test
+    strategy (which only observes the spread) on a replica of EnsembleContagionModel.
+    '''
+    def __init__(self, history):
+        self.history = history  # SpreadHistory
+        self.time = 0
+        self.terminate = len(self.history) < 2
+
+    def run(self):
+        self.time += 1
+        self.terminate = self.time >= len(self.history) - 1
+
+    def get_states(self):
+        return self.history[self.time]
+
+    def get_node_states(self, nodes):
+        index = self.history.get_index()
+        return STATE_NAMES[self.history.states_at(self.time)[[index[k] for k in nodes]]].tolist()
+
+    def get_history(self):
+        return self.history
+
+
+ENGINES = {'nx': ContagionModel, 'csr': CSRContagionModel, 'event': EventContagionModel}  # {engine: spread model class}
@@ -0,0 +1,462 @@
+import bisect
+import os
+
+import networkx as nx
+import numpy as np
+import scipy.sparse as sp
+from collections import Counter
+
+
+def percentile_of_counts(values, counts, q):
+    '''
+    np.percentile(q) of a multiset given as its sorted distinct values and their counts, without
+    expanding it (same linear interpolation as numpy)
+    '''
+    ends = np.cumsum(counts)  # rank after the last item of each value
+    pos = q/100*(ends[-1] - 1)
+    low, high = np.asarray(values)[np.searchsorted(ends, [np.floor(pos), np.ceil(pos)], side='right')]
+    t = pos - np.floor(pos)
+    if t >= 0.5:
+        return high - (high - low)*(1 - t)
+    return low + (high - low)*t
+
+
+class GraphState():
+    '''
+    Read-only CSR view of a networkx graph.
+    Nodes are mapped to contiguous indices (self.nodes[i] is the node with index i) and every
+    undirected edge gets an edge id (row of self.edges). Each edge appears in the adjacency of
+    both of its ends, self.eid maps an adjacency slot back to its edge id.
+    The arrays can be saved as .npy files and loaded back memory-mapped (see save and load).
+    '''
+    array_names = ['nodes', 'edges', 'indptr', 'indices', 'eid', 'nx_indices']
+
+    def __init__(self, graph, nodelist=None):
+        self.nx_graph = graph  # networkx graph, never modified here
+        self.nx_indices = None  # neighbor index of each slot in the order of the networkx adjacency, when loaded
+        if nodelist is None:
+            nodelist = list(graph.nodes())
+        self.nodes = np.asarray(nodelist)  # {index: node}
+        self.index = {n:i for i,n in enumerate(self.nodes.tolist())}  # {node: index}
+        num_nodes = len(self.nodes)
+        self.edges = np.asarray([(self.index[u], self.index[v]) for u,v in graph.edges()],
+                                dtype=np.int64).reshape(-1, 2)  # {edge_id: (index1, index2)}
+        num_edges = len(self.edges)
+        # both directions of each edge (self loops only once)
+        loop = self.edges[:,0] == self.edges[:,1]
+        src = np.concatenate([self.edges[:,0], self.edges[~loop,1]])
+        dst = np.concatenate([self.edges[:,1], self.edges[~loop,0]])
+        eid = np.concatenate([np.arange(num_edges), np.flatnonzero(~loop)])
+        order = np.lexsort((dst, src))
+        self.indices = dst[order]  # neighbor index of each adjacency slot
+        self.eid = eid[order]  # edge id of each adjacency slot
+        self.indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=num_nodes), out=self.indptr[1:])
+        self.matrix = None  # scipy sparse adjacency matrix, built on first use
+        self.edge_index = None  # {(node1, node2): edge_id}, both orders, built on first use
+
+    @property
+    def graph(self):
+        ''' the networkx graph, rebuilt from the arrays on first use if they were loaded '''
+        if self.nx_graph is None:
+            self.nx_graph = self.to_networkx()
+        return self.nx_graph
+
+    def save(self, directory):
+        '''
+        the arrays as .npy files in directory, with the node indices as int32, and the neighbors of
+        each node also in the order of the networkx adjacency (to rebuild the same graph)
+        '''
+        adj = self.graph.adj
+        nx_indices = np.fromiter((self.index[v] for u in self.nodes.tolist() for v in adj[u]),
+                                 dtype=np.int32, count=len(self.indices))
+        arrays = dict(nodes=self.nodes, edges=self.edges.astype(np.int32), indptr=self.indptr,
+                      indices=self.indices.astype(np.int32), eid=self.eid.astype(np.int32), nx_indices=nx_indices)
+        for name in self.array_names:
+            np.save(os.path.join(directory, name + '.npy'), arrays[name])
+
+    @classmethod
+    def load(cls, directory):
+        ''' GraphState over the memory-mapped arrays saved in directory, the networkx graph is built on first use '''
+        topo = cls.__new__(cls)
+        for name in cls.array_names:
+            setattr(topo, name, np.load(os.path.join(directory, name + '.npy'), mmap_mode='r'))
+        topo.nx_graph = None
+        topo.index = {n:i for i,n in enumerate(topo.nodes.tolist())}
+        topo.matrix = None
+        topo.edge_index = None
+        return topo
+
+    def to_networkx(self):
+        ''' networkx graph with the nodes and the neighbors of each node in the saved order '''
+        graph = nx.Graph()
+        nodes = self.nodes.tolist()
+        graph.add_nodes_from(nodes)
+        adj = graph._adj  # filled directly to keep the neighbor order, both ends share the edge data dict
+        neighbors = self.nodes[self.nx_indices].tolist()
+        indptr = self.indptr.tolist()
+        for i, u in enumerate(nodes):
+            for v in neighbors[indptr[i]:indptr[i+1]]:
+                adj[u][v] = adj[v].get(u, {})
+        return graph
+
+    def number_of_nodes(self):
+        return len(self.nodes)
+
+    def number_of_edges(self):
+        return len(self.edges)
+
+    def degree(self):
+        return np.diff(self.indptr)
+
+    def neighbors(self, node):
+        ''' the neighbors of node in the order of the networkx adjacency, without building the networkx graph '''
+        if self.nx_graph is not None:
+            return self.nx_graph.neighbors(node)
+        i = self.index[node]
+        return iter(self.nodes[self.nx_indices[self.indptr[i]:self.indptr[i+1]]].tolist())
+
+    def has_edge(self, u, v):
+        if u not in self.index or v not in self.index:
+            return False
+        i, j = self.index[u], self.index[v]
+        row = self.indices[self.indptr[i]:self.indptr[i+1]]  # sorted
+        k = np.searchsorted(row, j)
+        return bool(k < len(row) and row[k] == j)
+
+    def adjacency(self, edge_mask=None):
+        '''
+        (num_nodes x num_nodes) scipy CSR adjacency matrix sharing the arrays of this object,
+        only with the edges where edge_mask is True if it is given
+        '''
+        num_nodes = len(self.nodes)
+        if edge_mask is not None:
+            return sp.csr_matrix((edge_mask[self.eid].astype(np.int32), self.indices, self.indptr),
+                                 shape=(num_nodes, num_nodes))
+        if self.matrix is None:
+            self.matrix = sp.csr_matrix((np.ones(len(self.indices), dtype=np.int32), self.indices, self.indptr),
+                                        shape=(num_nodes, num_nodes))
+        return self.matrix
+
+    def expand(self, rows):
+        '''
+        input:
+            - rows: array of node indices
+        output:
+            - owner: position in rows of the node owning each slot
+            - slots: adjacency slots of all the nodes in rows, concatenated in order
+        '''
+        rows = np.asarray(rows, dtype=np.int64)
+        start = self.indptr[rows]
+        count = self.indptr[rows + 1] - start
+        owner = np.repeat(np.arange(len(rows)), count)
+        offset = np.repeat(start - (np.cumsum(count) - count), count)
+        slots = np.arange(count.sum()) + offset
+        return owner, slots
+
+    def sample_slots(self, rows, fraction):
+        '''
+        input:
+            - rows: array of node indices
+            - fraction: int(degree*fraction) of the slots of each row are drawn, without replacement
+        output:
+            - owner, slots: like expand, only for the drawn slots
+        '''
+        rows = np.asarray(rows, dtype=np.int64)
+        owner, slots = self.expand(rows)
+        count = (np.diff(self.indptr)[rows]*fraction).astype(np.int64)
+        # random order within each row, keep the first count slots
+        order = np.lexsort((np.random.random_sample(len(slots)), owner))
+        owner, slots = owner[order], slots[order]
+        rank = np.arange(len(owner)) - np.searchsorted(owner, np.arange(len(rows)))[owner]
+        keep = rank < count[owner]
+        return owner[keep], slots[keep]
+
+    def edge_id(self, u, v):
+        ''' edge id of the edge between nodes u and v (KeyError if there is no such edge) '''
+        if self.edge_index is None:
+            self.edge_index = {}
+            for e, (i, j) in enumerate(self.nodes[self.edges].tolist()):
+                self.edge_index[(i, j)] = e
+                self.edge_index[(j, i)] = e
+        return self.edge_index[(u, v)]
+
+
+class RestrictionOverlay():
+    '''
+    Restrictions over a GraphState, without copying or modifying it.
+    edge_mask[edge_id] is False while the edge is cut and node_mask[node_index] is True while
+    the node is restricted, so cutting or restoring an edge is one array write. The spread
+    models read the masks directly. The part of the networkx graph interface used by the
+    mitigation strategies and the spread models is available for the current graph
+    (base graph minus the cut edges).
+    '''
+    def __init__(self, topo):
+        self.topo = topo  # GraphState, shared
+        self.edge_mask = np.ones(topo.number_of_edges(), dtype=bool)  # {edge_id: not cut}
+        self.node_mask = np.zeros(topo.number_of_nodes(), dtype=bool)  # {node_index: restricted}
+
+    def copy(self):
+        overlay = RestrictionOverlay(self.topo)
+        overlay.edge_mask[:] = self.edge_mask
+        overlay.node_mask[:] = self.node_mask
+        return overlay
+
+    # ----- restrictions
+    def remove_edges_from(self, edges):
+        self.edge_mask[[self.topo.edge_id(u, v) for u,v in edges]] = False
+
+    def add_edges_from(self, edges):
+        self.edge_mask[[self.topo.edge_id(u, v) for u,v in edges]] = True
+
+    def remove_edge_ids(self, eids):
+        self.edge_mask[eids] = False
+
+    def restrict_nodes(self, nodes):
+        self.node_mask[[self.topo.index[n] for n in nodes]] = True
+
+    def release_nodes(self, nodes):
+        self.node_mask[[self.topo.index[n] for n in nodes]] = False
+
+    @property
+    def graph(self):
+        return self.topo.graph
+
+    # ----- networkx-like read access
+    def __iter__(self):
+        return iter(self.topo.nodes.tolist())
+
+    def __len__(self):
+        return self.topo.number_of_nodes()
+
+    def __contains__(self, node):
+        return node in self.topo.index
+
+    def nodes(self):
+        return self.topo.nodes.tolist()
+
+    def number_of_nodes(self):
+        return self.topo.number_of_nodes()
+
+    def number_of_edges(self):
+        return int(self.edge_mask.sum())
+
+    def open_slots(self, node):
+        i = self.topo.index[node]
+        slots = np.arange(self.topo.indptr[i], self.topo.indptr[i+1])
+        return slots[self.edge_mask[self.topo.eid[slots]]]
+
+    def neighbors(self, node):
+        return iter(self.topo.nodes[self.topo.indices[self.open_slots(node)]].tolist())
+
+    def degree(self, node):
+        return len(self.open_slots(node))
+
+    def has_edge(self, u, v):
+        try:
+            return bool(self.edge_mask[self.topo.edge_id(u, v)])
+        except KeyError:
+            return False
+
+    def edges(self, node=None):
+        if node is None:
+            return [tuple(e) for e in self.topo.nodes[self.topo.edges[self.edge_mask]].tolist()]
+        return [(node, neigh) for neigh in self.neighbors(node)]
+
+
+class KnownGraph(nx.Graph):
+    '''
+    networkx graph of the known part of the network (nodes + traced edges) that keeps its
+    degree histogram and number of edges up to date as edges are added (or removed), so they
+    do not have to be recounted over all the nodes at every test round. The nodes are also kept
+    in buckets by degree, so the top nodes by degree and the degree percentiles are read from
+    the buckets and the histogram instead of sorting all the nodes. A bucket keeps the positions
+    of its nodes (in the order the nodes were added) sorted, in blocks of at most 2*BLOCK, so
+    moving a node costs O(log + BLOCK) and the first k nodes of a bucket are read in O(k). For the local structure
+    scores, the number of triangles through each node and the sum of the degrees of its
+    neighbors are kept too (self loops are left out of them).
+    '''
+    BLOCK = 256
+
+    def __init__(self, incoming_graph_data=None, **attr):
+        self.deg_hist = Counter()  # {degree: number of nodes}
+        self.buckets = {}  # {degree: [[positions]]}, the sorted positions of the nodes of each degree, in blocks
+        self.block_last = {}  # {degree: [last position of each block]}
+        self.order = {}  # {node: position in the order the nodes were added}, the tie-break of the buckets
+        self.at = {}  # {position: node}
+        self.added = 0  # number of nodes added so far
+        self.triangles = {}  # {node: number of edges between its neighbors}
+        self.nbr_degree = {}  # {node: sum of the degrees of its neighbors}
+        self.hist_delta = Counter()  # changes of deg_hist since the last pop_hist_delta call
+        self.num_edges = 0  # number of edges (subgraph views of this graph do not keep it)
+        self.edge_log = []  # [(node1, node2, +1 added or -1 removed)] in order, readers keep their position in it
+        super().__init__(incoming_graph_data, **attr)
+
+    def move_degree(self, node, change):
+        deg = self.degree(node)
+        for d, c in ((deg - change, -1), (deg, 1)):
+            self.deg_hist[d] += c
+            self.hist_delta[d] += c
+        self.bucket_remove(deg - change, node)
+        self.bucket_add(deg, node)
+
+    def bucket_add(self, deg, node):
+        pos = self.order[node]
+        blocks, last = self.buckets.setdefault(deg, []), self.block_last.setdefault(deg, [])
+        if not blocks:
+            blocks.append([])
+            last.append(pos)
+        i = min(bisect.bisect_left(last, pos), len(blocks) - 1)
+        block = blocks[i]
+        bisect.insort(block, pos)
+        last[i] = block[-1]
+        if len(block) > 2*self.BLOCK:
+            blocks[i:i+1] = [block[:self.BLOCK], block[self.BLOCK:]]
+            last.insert(i, block[self.BLOCK-1])
+
+    def bucket_remove(self, deg, node):
+        pos = self.order[node]
+        blocks, last = self.buckets[deg], self.block_last[deg]
+        i = bisect.bisect_left(last, pos)
+        block = blocks[i]
+        del block[bisect.bisect_left(block, pos)]
+        if block:
+            last[i] = block[-1]
+        else:
+            del blocks[i], last[i]
+        if not blocks:
+            self.buckets.pop(deg)
+            self.block_last.pop(deg)
+
+    def count_local(self, u, v, sign):
+        ''' update the triangles and neighbor degrees for the edge (u, v), called while it is not in the graph '''
+        adj_u, adj_v = self._adj[u], self._adj[v]
+        small, big = (adj_u, adj_v) if len(adj_u) <= len(adj_v) else (adj_v, adj_u)
+        common = [w for w in small if w in big and w != u and w != v]
+        self.triangles[u] += sign*len(common)
+        self.triangles[v] += sign*len(common)
+        for w in common:
+            self.triangles[w] += sign
+        # the degrees of u and v change by one
+        for n, adj in ((u, adj_u), (v, adj_v)):
+            for w in adj:
+                if w != n:
+                    self.nbr_degree[w] += sign
+        self.nbr_degree[u] += sign*(self.loopless_degree(v) + 1)
+        self.nbr_degree[v] += sign*(self.loopless_degree(u) + 1)
+
+    def loopless_degree(self, node):
+        ''' number of neighbors of node other than itself '''
+        adj = self._adj[node]
+        return len(adj) - (node in adj)
+
+    def add_node(self, node_for_adding, **attr):
+        if node_for_adding not in self._node:
+            self.deg_hist[0] += 1
+            self.hist_delta[0] += 1
+            self.order[node_for_adding] = self.added
+            self.at[self.added] = node_for_adding
+            self.added += 1
+            self.bucket_add(0, node_for_adding)
+            self.triangles[node_for_adding] = 0
+            self.nbr_degree[node_for_adding] = 0
+        super().add_node(node_for_adding, **attr)
+
+    def add_nodes_from(self, nodes_for_adding, **attr):
+        for n in nodes_for_adding:
+            if isinstance(n, tuple) and len(n) == 2 and isinstance(n[1], dict):  # (node, attr_dict)
+                self.add_node(n[0], **{**attr, **n[1]})
+            else:
+                self.add_node(n, **attr)
+
+    def add_edge(self, u_of_edge, v_of_edge, **attr):
+        u, v = u_of_edge, v_of_edge
+        new = not self.has_edge(u, v)
+        for n in (u, v):
+            if n not in self._node:
+                self.add_node(n)
+        if new and u != v:
+            self.count_local(u, v, 1)
+        super().add_edge(u, v, **attr)
+        if new:
+            self.num_edges += 1
+            self.edge_log.append((u, v, 1))
+            if u == v:
+                self.move_degree(u, 2)
+            else:
+                self.move_degree(u, 1)
+                self.move_degree(v, 1)
+
+    def add_edges_from(self, ebunch_to_add, **attr):
+        for e in ebunch_to_add:
+            if len(e) == 3:
+                self.add_edge(e[0], e[1], **{**attr, **e[2]})
+            else:
+                self.add_edge(e[0], e[1], **attr)
+
+    def remove_edge(self, u, v):
+        super().remove_edge(u, v)
+        self.num_edges -= 1
+        self.edge_log.append((u, v, -1))
+        if u != v:
+            self.count_local(u, v, -1)
+        if u == v:
+            self.move_degree(u, -2)
+        else:
+            self.move_degree(u, -1)
+            self.move_degree(v, -1)
+
+    def remove_edges_from(self, ebunch):
+        for e in ebunch:
+            if self.has_edge(e[0], e[1]):
+                self.remove_edge(e[0], e[1])
+
+    def remove_node(self, n):
+        self.remove_edges_from(list(self.edges(n)))
+        super().remove_node(n)
+        self.deg_hist[0] -= 1
+        self.hist_delta[0] -= 1
+        self.bucket_remove(0, n)
+        self.at.pop(self.order.pop(n))
+        self.triangles.pop(n)
+        self.nbr_degree.pop(n)
+
+    def remove_nodes_from(self, nodes):
+        for n in list(nodes):
+            if n in self._node:
+                self.remove_node(n)
+
+    def number_of_edges(self, u=None, v=None):
+        if u is None and not nx.is_frozen(self):  # views of this graph (e.g., subgraphs) do not keep num_edges
+            return self.num_edges
+        return super().number_of_edges(u, v)
+
+    def get_deg_dist(self):
+        ''' {degree: number of nodes} '''
+        return {d:c for d,c in self.deg_hist.items() if c != 0}
+
+    def pop_hist_delta(self):
+        ''' {degree: change in number of nodes} since the last call '''
+        delta = {d:c for d,c in self.hist_delta.items() if c != 0}
+        self.hist_delta = Counter()
+        return delta
+
+    def top_by_degree(self, k, exclude=()):
+        '''
+        up to k nodes in descending order of degree, skipping the nodes in exclude, the nodes of
+        the same degree in node order (as a stable sort of the nodes by degree)
+        '''
+        top = []
+        for d in sorted(self.buckets, reverse=True):
+            for block in self.buckets[d]:
+                for pos in block:
+                    if len(top) == k:
+                        return top
+                    if self.at[pos] not in exclude:
+                        top.append(self.at[pos])
+        return top
+
+    def degree_percentile(self, q):
+        ''' np.percentile of the degrees of all the nodes, from the histogram '''
+        degrees = sorted(d for d,c in self.deg_hist.items() if c > 0)
+        return percentile_of_counts(degrees, [self.deg_hist[d] for d in degrees], q)
@@ -0,0 +1,337 @@
+import numpy as np
+
+STATE_NAMES = np.asarray(['S', 'I', 'R'])  # {state_code: state}
+STATE_CODES = {'S': 0, 'I': 1, 'R': 2}  # {state: state_code}
+
+
+def pack(arrays, dtype):
+    ''' list of 1d arrays -> (concatenated array, offsets), for the compact pickles '''
+    offsets = np.cumsum([0] + [len(a) for a in arrays])
+    return np.concatenate([np.zeros(0, dtype=dtype)] + list(arrays)).astype(dtype), offsets
+
+
+def unpack(values, offsets):
+    ''' (concatenated array, offsets) -> list of 1d arrays '''
+    return [values[a:b] for a,b in zip(offsets[:-1], offsets[1:])]
+
+
+class LatestStates(dict):
+    '''
+    {node: latest test result} that also logs the nodes whose result was set or changed, in
+    order, so a reader that keeps its position in the log only looks at the new changes.
+    '''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.log = list(self)  # [node] in the order their result changed
+
+    def __setitem__(self, node, state):
+        if self.get(node) != state:
+            self.log.append(node)
+        super().__setitem__(node, state)
+
+
+class SpreadHistory():
+    '''
+    Compact history of a spread: the int8 state codes of all nodes at time 0 and, for every
+    later time, a change log of (node_index, new_state_code) for the nodes whose state changed.
+    It can be used like the old history ([{node: state}], one item per time): len(history),
+    history[t] and iteration rebuild the {node: state} dicts on request, while the metrics
+    use counts() / new_infections() / states_at() directly on the compact form.
+    '''
+    def __init__(self, nodes, states):
+        '''
+        input:
+            - nodes: list of nodes, the node index is the position in this list
+            - states: {node: state} or array of state codes (by node index) at time 0
+        '''
+        self.nodes = np.asarray(nodes)  # {node_index: node}
+        if isinstance(states, dict):
+            states = [STATE_CODES[states[n]] for n in self.nodes.tolist()]
+        self.initial = np.array(states, dtype=np.int8)  # {node_index: state_code} at time 0 (own copy)
+        self.changed = []  # [node indices changed at time t], t = 1, 2, ...
+        self.new_states = []  # [their new state codes at time t]
+        self.index = None  # {node: node_index}, built on first use
+        self.current = self.initial.copy()  # state codes at the last time
+        self.cursor = (0, self.initial.copy())  # (t, state codes at t) of the last states_at call
+
+    # ----- recording
+    def record(self, nodes, codes):
+        '''
+        input:
+            - nodes: node indices whose state may have changed since the last time
+            - codes: their state codes now
+        '''
+        nodes = np.asarray(nodes, dtype=np.int64).reshape(-1)
+        codes = np.asarray(codes, dtype=np.int8).reshape(-1)
+        diff = self.current[nodes] != codes  # keep only real changes
+        nodes, codes = nodes[diff], codes[diff]
+        self.current[nodes] = codes
+        self.changed.append(nodes.astype(np.int32))
+        self.new_states.append(codes)
+
+    def record_states(self, states):
+        ''' states: {node: state} of the nodes whose state may have changed since the last time '''
+        index = self.get_index()
+        self.record([index[n] for n in states], [STATE_CODES[s] for s in states.values()])
+
+    def record_array(self, codes):
+        ''' codes: state codes of all the nodes (by node index) now '''
+        nodes = np.flatnonzero(self.current != codes)
+        self.record(nodes, codes[nodes])
+
+    # ----- compact access
+    def get_index(self):
+        if self.index is None:
+            self.index = {n:i for i,n in enumerate(self.nodes.tolist())}
+        return self.index
+
+    def states_at(self, t):
+        ''' state codes (by node index) at time t, sequential calls only apply the new changes '''
+        t = range(len(self))[t]
+        start, codes = self.cursor
+        if start > t:
+            start, codes = 0, self.initial.copy()
+        for step in range(start, t):
+            codes[self.changed[step]] = self.new_states[step]
+        self.cursor = (t, codes)
+        return codes.copy()
+
+    def state_matrix(self):
+        ''' (len(self) x num_nodes) int8 array of state codes '''
+        matrix = np.empty((len(self), len(self.nodes)), dtype=np.int8)
+        matrix[0] = self.initial
+        for t in range(1, len(self)):
+            matrix[t] = matrix[t-1]
+            matrix[t, self.changed[t-1]] = self.new_states[t-1]
+        return matrix
+
+    def counts(self, state):
+        ''' number of nodes in state ('S', 'I', 'R') at each time '''
+        code = STATE_CODES[state]
+        codes = self.initial.copy()
+        counts = np.empty(len(self), dtype=np.int64)
+        counts[0] = np.count_nonzero(codes == code)
+        for t in range(1, len(self)):
+            nodes, new = self.changed[t-1], self.new_states[t-1]
+            counts[t] = counts[t-1] + np.count_nonzero(new == code) - np.count_nonzero(codes[nodes] == code)
+            codes[nodes] = new
+        return counts
+
+    def new_infections(self):
+        ''' number of nodes that are infected at each time and were not at the time before (all infected at time 0) '''
+        return np.asarray([np.count_nonzero(self.initial == STATE_CODES['I'])] + \
+                          [np.count_nonzero(new == STATE_CODES['I']) for new in self.new_states])
+
+    # ----- old format, rebuilt on request
+    def __len__(self):
+        return len(self.changed) + 1
+
+    def __getitem__(self, t):
+        if isinstance(t, slice):
+            return [self[i] for i in range(len(self))[t]]
+        return dict(zip(self.nodes.tolist(), STATE_NAMES[self.states_at(t)].tolist()))
+
+    def __iter__(self):
+        nodes = self.nodes.tolist()
+        codes = self.initial.copy()
+        yield dict(zip(nodes, STATE_NAMES[codes].tolist()))
+        for changed, new in zip(self.changed, self.new_states):
+            codes[changed] = new
+            yield dict(zip(nodes, STATE_NAMES[codes].tolist()))
+
+    def __getstate__(self):
+        # only the compact form is pickled
+        changed, offsets = pack(self.changed, np.int32)
+        new_states, _ = pack(self.new_states, np.int8)
+        return {'nodes': self.nodes, 'initial': self.initial, 'offsets': offsets,
+                'changed': changed, 'new_states': new_states}
+
+    def __setstate__(self, data):
+        self.nodes = data['nodes']
+        self.initial = data['initial']
+        self.changed = unpack(data['changed'], data['offsets'])
+        self.new_states = unpack(data['new_states'], data['offsets'])
+        self.index = None
+        self.cursor = (0, self.initial.copy())
+        self.current = self.states_at(-1)
+
+
+class RestrictionHistory():
+    '''
+    Compact history of a mitigation strategy: the restrictions as intervals
+    (node_index, start, end), the node is restricted ('Y') at times start <= t < end.
+    It can be used like the old history ([{node: 'Y' or 'N'}], one item per time): len(history),
+    history[t] and iteration rebuild the dicts on request, while restricted_counts() and
+    intervals() work on the log directly.
+    '''
+    def __init__(self, state):
+        '''
+        input:
+            - state: {node: 'Y' or 'N'} at time 0
+        '''
+        self.nodes = np.asarray(list(state))  # {node_index: node}
+        self.index = {n:i for i,n in enumerate(self.nodes.tolist())}  # {node: node_index}
+        self.length = 1  # number of times recorded, the changes go to time self.length
+        self.active = {self.index[n]:0 for n,s in state.items() if s == 'Y'}  # {node_index: start} of ongoing restrictions
+        self.closed = []  # [(node_index, start, end)] of finished restrictions
+
+    # ----- recording
+    def restrict(self, nodes):
+        ''' nodes: nodes that become restricted ('N' -> 'Y') at the current time '''
+        for n in nodes:
+            self.active.setdefault(self.index[n], self.length)
+
+    def release(self, nodes):
+        ''' nodes: nodes that are released ('Y' -> 'N') at the current time '''
+        for n in nodes:
+            start = self.active.pop(self.index[n], None)
+            if start is not None and start < self.length:
+                self.closed.append((self.index[n], start, self.length))
+
+    def step(self):
+        ''' the restrictions of the current time are all recorded '''
+        self.length += 1
+
+    # ----- compact access
+    def intervals(self):
+        '''
+        output:
+            - node_index, start, end arrays of all the restrictions (ongoing ones end at len(self))
+        '''
+        items = self.closed + [(i, start, self.length) for i,start in self.active.items()]
+        items = np.asarray(items, dtype=np.int64).reshape(-1, 3)
+        return items[:,0], items[:,1], items[:,2]
+
+    def restricted_counts(self):
+        ''' number of restricted nodes at each time '''
+        _, start, end = self.intervals()
+        diff = np.bincount(start, minlength=self.length + 1) - np.bincount(end, minlength=self.length + 1)
+        return np.cumsum(diff)[:self.length]
+
+    # ----- old format, rebuilt on request
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, t):
+        if isinstance(t, slice):
+            return [self[i] for i in range(len(self))[t]]
+        t = range(len(self))[t]
+        node, start, end = self.intervals()
+        state = dict.fromkeys(self.nodes.tolist(), 'N')
+        state.update(dict.fromkeys(self.nodes[node[(start <= t) & (t < end)]].tolist(), 'Y'))
+        return state
+
+    def __iter__(self):
+        for t in range(len(self)):
+            yield self[t]
+
+    def __getstate__(self):
+        node, start, end = self.intervals()
+        ongoing = np.zeros(len(node), dtype=bool)
+        ongoing[len(self.closed):] = True
+        return {'nodes': self.nodes, 'length': self.length, 'node': node.astype(np.int32),
+                'start': start.astype(np.int32), 'end': end.astype(np.int32), 'ongoing': ongoing}
+
+    def __setstate__(self, data):
+        self.nodes = data['nodes']
+        self.index = {n:i for i,n in enumerate(self.nodes.tolist())}
+        self.length = data['length']
+        items = zip(data['node'].tolist(), data['start'].tolist(), data['end'].tolist(), data['ongoing'].tolist())
+        self.active = {}
+        self.closed = []
+        for node, start, end, ongoing in items:
+            if ongoing:
+                self.active[node] = start
+            else:
+                self.closed.append((node, start, end))
+
+
+class TestHistory():
+    '''
+    Compact history of a test strategy: for every test round, the tested node indices, their
+    int8 state codes, the number of known edges and the changes of the known degree histogram
+    as (degree, change) pairs. It can be used like the old history
+    ([([nodes_tested], [their_states], {num_edges: , deg_dist: {degree: count}})], one item per round):
+    len(history), history[r] and iteration rebuild the items on request, while positives() and
+    sizes() work on the arrays directly.
+    '''
+    def __init__(self, nodes, deg_dist):
+        '''
+        input:
+            - nodes: list of nodes, the node index is the position in this list
+            - deg_dist: {degree: count} of the known graph before the first round
+        '''
+        self.nodes = np.asarray(nodes)  # {node_index: node}
+        self.index = {n:i for i,n in enumerate(self.nodes.tolist())}  # {node: node_index}
+        self.initial_deg = dict(deg_dist)
+        self.tested = []  # [node indices tested at round r]
+        self.results = []  # [their state codes at round r]
+        self.num_edges = []  # [number of known edges after round r]
+        self.deg_change = []  # [(2 x k) array of degrees and their count changes at round r]
+
+    # ----- recording
+    def record(self, nodes_tested, test_results, num_edges, deg_delta):
+        '''
+        input:
+            - nodes_tested, test_results: tested nodes and their states ('S', 'I', 'R')
+            - num_edges: number of known edges after the round
+            - deg_delta: {degree: change in count} of the known graph during the round
+        '''
+        self.tested.append(np.asarray([self.index[n] for n in np.asarray(nodes_tested).tolist()], dtype=np.int32))
+        self.results.append(np.asarray([STATE_CODES[s] for s in test_results], dtype=np.int8))
+        self.num_edges.append(num_edges)
+        self.deg_change.append(np.asarray(list(deg_delta.items()), dtype=np.int64).reshape(-1, 2).T)
+
+    # ----- compact access
+    def positives(self):
+        ''' number of positive ('I') tests at each round '''
+        return np.asarray([np.count_nonzero(res == STATE_CODES['I']) for res in self.results], dtype=np.int64)
+
+    def sizes(self):
+        ''' number of tested nodes at each round '''
+        return np.asarray([len(res) for res in self.results], dtype=np.int64)
+
+    def item(self, r, deg_dist):
+        return (self.nodes[self.tested[r]], STATE_NAMES[self.results[r]],
+                dict(num_edges = self.num_edges[r], deg_dist = {d:c for d,c in deg_dist.items() if c != 0}))
+
+    # ----- old format, rebuilt on request
+    def __len__(self):
+        return len(self.tested)
+
+    def __getitem__(self, r):
+        if isinstance(r, slice):
+            return [self[i] for i in range(len(self))[r]]
+        r = range(len(self))[r]
+        deg_dist = dict(self.initial_deg)
+        for degrees, changes in self.deg_change[:r+1]:
+            for d, c in zip(degrees.tolist(), changes.tolist()):
+                deg_dist[d] = deg_dist.get(d, 0) + c
+        return self.item(r, deg_dist)
+
+    def __iter__(self):
+        deg_dist = dict(self.initial_deg)
+        for r in range(len(self)):
+            degrees, changes = self.deg_change[r]
+            for d, c in zip(degrees.tolist(), changes.tolist()):
+                deg_dist[d] = deg_dist.get(d, 0) + c
+            yield self.item(r, deg_dist)
+
+    def __getstate__(self):
+        tested, offsets = pack(self.tested, np.int32)
+        results, _ = pack(self.results, np.int8)
+        degrees, deg_offsets = pack([d for d,_ in self.deg_change], np.int64)
+        changes, _ = pack([c for _,c in self.deg_change], np.int64)
+        return {'nodes': self.nodes, 'initial_deg': self.initial_deg, 'offsets': offsets,
+                'tested': tested, 'results': results, 'num_edges': np.asarray(self.num_edges, dtype=np.int64),
+                'deg_offsets': deg_offsets, 'degrees': degrees, 'changes': changes}
+
+    def __setstate__(self, data):
+        self.nodes = data['nodes']
+        self.index = {n:i for i,n in enumerate(self.nodes.tolist())}
+        self.initial_deg = data['initial_deg']
+        self.tested = unpack(data['tested'], data['offsets'])
+        self.results = unpack(data['results'], data['offsets'])
+        self.num_edges = data['num_edges'].tolist()
+        self.deg_change = [np.stack([d, c]) for d,c in zip(unpack(data['degrees'], data['deg_offsets']),
+                                                           unpack(data['changes'], data['deg_offsets']))]
@@ -1,22 +1,79 @@
-import networkx as nx
+import bisect
+import heapq
+from collections import deque
 import numpy as np
-import pdb
+
+from graph_state import GraphState, KnownGraph, RestrictionOverlay, percentile_of_counts
+from history import LatestStates, RestrictionHistory
+
+class TimerWheel():
+    '''
+    {item: time left} timers stored by the step they run out at, so a step only looks at the
+    items that run out now instead of counting down all of them. Setting an item again moves
+    it to its new step (the old entry is skipped when its step comes).
+    '''
+    def __init__(self):
+        self.now = 0  # steps passed
+        self.expiry = {}  # {item: step it runs out at}
+        self.slots = {}  # {step: [items]}
+
+    def __setitem__(self, item, time):
+        step = self.now + max(time, 1)  # counted down from time, out once below 1
+        self.expiry[item] = step
+        self.slots.setdefault(step, []).append(item)
+
+    def __getitem__(self, item):
+        return self.expiry[item] - self.now
+
+    def __contains__(self, item):
+        return item in self.expiry
+
+    def __len__(self):
+        return len(self.expiry)
+
+    def __iter__(self):
+        return iter(self.expiry)
+
+    def update(self, timers):
+        for item, time in timers.items():
+            self[item] = time
+
+    def pop(self, item, default=None):
+        if item not in self.expiry:
+            return default
+        return self.expiry.pop(item) - self.now
+
+    def tick(self):
+        ''' one step passes, the items that run out are removed and returned '''
+        self.now += 1
+        out = []
+        for item in self.slots.pop(self.now, []):
+            if self.expiry.get(item) == self.now:
+                out.append(item)
+                del self.expiry[item]
+        return out
+
 
 class MitigationStrategy():
     def __init__(self, method, graph_known, graph_unknown, clusters, test_states, **params):
         # immutable
         self.method = method  # string
-        self.clusters = dict(enumerate(clusters))  # {cluster_id: [members]}
+        self.clusters = dict(enumerate(clusters))  # {cluster_id: [members]}, {cluster_id: {member: None}} with online_coms
         self.node_cluster = {i:k for k,v in self.clusters.items() for i in v}
         if params:
             self.params = params  # {restrict_time: T1, restrict_candidate_budget: M,
-            #   restrict_candidate_neigh_budget: P, ban_time: T2 (or =T1), cthr:}
+            #   restrict_candidate_neigh_budget: P, ban_time: T2 (or =T1), cthr:, nscore: A, B (or) C,
+            #   online_coms: True to keep the communities up to date on graph_k}
             if 'ban_time' not in self.params:
                 self.params['ban_time'] = self.params['restrict_time']
             if self.params['restrict_candidate_budget'] < 1:
                 self.params['restrict_candidate_budget'] = 5
             if self.params['restrict_candidate_neigh_budget'] < 1:
                 self.params['restrict_candidate_neigh_budget'] = 2
+            if 'nscore' not in self.params:
+                self.params['nscore'] = 'B'
+            if 'online_coms' not in self.params:
+                self.params['online_coms'] = False
         else:
             tmp = int(np.ceil(0.001*graph_known.number_of_nodes()))
             if tmp == 0:
@@ -24,21 +81,44 @@ class MitigationStrategy():
             self.params = dict(restrict_time= 4, 
                             restrict_candidate_budget= tmp, 
                             restrict_candidate_neigh_budget= 2, 
-                            community_thr = 0.1)
+                            community_thr = 0.1,
+                            nscore = 'B',
+                            online_coms = False)
             self.params['ban_time'] = self.params['restrict_time']
+        if self.params['online_coms']:  # the partition is refined on graph_k (see local_moves),
+            # members are kept as ordered sets to move them around
+            self.clusters = {k:dict.fromkeys(v) for k,v in self.clusters.items()}
         
         # mutable
-        self.graph_k = graph_known.copy()  # updated by test startegy through set_graph_k
-        self.graph_u = graph_unknown.copy()  # updated internally in mitigation strategy (frag)
-        self.com_graphs = {k:nx.subgraph(self.graph_k,self.clusters[k]) for k in self.clusters}  # {cluster_id: cluster_graph}
+        # updated by test startegy through set_graph_k. Read-only, shared (a networkx graph is copied into a KnownGraph)
+        self.graph_k = graph_known if isinstance(graph_known, KnownGraph) else KnownGraph(graph_known)
+        # updated internally in mitigation strategy (frag), restrictions are masks over graph_unknown
+        # that the spread model reads directly (see graph_state.RestrictionOverlay)
+        self.graph_u = RestrictionOverlay(graph_unknown if isinstance(graph_unknown, GraphState) \
+                                            else GraphState(graph_unknown))
         self.state = {n:'N' for n in self.graph_u.nodes()}  # 'N': not restricted, 'Y': restricted
-        self.history = [self.state.copy()]  # keep history of the states
-        self.ban = {}  # {node: time} dict of nodes banned to restrict, used in frag level, reduce time every 'run',
+        self.history = RestrictionHistory(self.state)  # keep history of the states, as restriction intervals
+        # the timers are kept by the step they run out at (see TimerWheel), each 'run' only pops what runs out now
+        self.ban = TimerWheel()  # {node: time} nodes banned to restrict, used in frag level,
         #   remove from list once time=0
-        self.restricted_node = {}  # {node: time} dict of nodes restricted, reduce time every 'run', 
-        #   release node once the time hits 0
-        self.restricted_edge = {}  # {(nod1,node2): time} dict of edges restricted, reduce time every 'run', 
-        #   put the edge back on once the time hits 0
+        self.restricted_node = TimerWheel()  # {node: time} nodes restricted, release node once the time hits 0
+        self.restricted_edge = TimerWheel()  # {(nod1,node2): time} edges restricted, put the edge back on once the time hits 0
+        self.com_restricted = TimerWheel()  # {cluster_id: time} communities isolated by comiso,
+        #   release the members once the time hits 0
+        # community counters for Cscore, kept up to date from the edge log of graph_k and the
+        # change log of the test results (clusters are a partition of the nodes)
+        self.com_members = np.asarray([len(self.clusters[k]) for k in self.clusters])  # {cluster_id: members}
+        self.com_size = np.zeros(len(self.clusters), dtype=np.int64)  # {cluster_id: members in graph_k}
+        self.com_inf = np.zeros(len(self.clusters), dtype=np.int64)  # {cluster_id: members tested 'I' lately}
+        self.com_inside = np.zeros(len(self.clusters), dtype=np.int64)  # {cluster_id: edges of graph_k inside}
+        self.com_boundary = np.zeros(len(self.clusters), dtype=np.int64)  # {cluster_id: edges of graph_k to outside}
+        self.test_inf = set()  # nodes counted in com_inf
+        self.blocked = set()  # nodes banned or restricted, not candidates to restrict
+        self.com_blocked = np.zeros(len(self.clusters), dtype=np.int64)  # {cluster_id: members in blocked}
+        self.com_order = {}  # {cluster_id: members in graph_k order}, with the counters
+        self.node_pos = {}  # {node: position in graph_k}, with the counters
+        self.edge_cursor = (None, 0)  # (graph_k, position in its edge log) counted so far
+        self.state_cursor = (None, 0)  # (test_states, position in its log) counted so far
         self.set_Cscore(test_states)  # sets self.Cscore {community: score}
         self.set_Nscore()  # sets self.Nscore {node: score} -- depends on self.Cscore
         
@@ -63,35 +143,8 @@ class MitigationStrategy():
             test_states: the state of nodes inferred by testing result over time {node:}
             test_latest_inf: the list of nodes that are identified as infected in this time [nodes_inf]
         '''
-        # ----- update time for self.restricted and self.ban and follow up graph_u, ban, and state update 
-        # update time for already banned nodes
-        self.ban = {k: v-1 for k,v in self.ban.items()}
-        rem = [k for k,v in self.ban.items() if v<1]
-        for k in rem:
-            self.ban.pop(k)
-        # update time for already restricted edges
-        self.restricted_edge = {k: v-1 for k,v in self.restricted_edge.items()}
-        self.restricted_node = {k: v-1 for k,v in self.restricted_node.items()}
-        edges = [k for k,v in self.restricted_edge.items() if v < 1]  
-        node_release = [k for k,v in self.restricted_node.items() if v < 1]
-        edge_release = []
-        # we don't want the edges to be released if the other end is still in restriction
-        for e in edges: 
-            if e[0] in node_release:
-                if self.state[e[1]] == 'N':
-                    edge_release.append(e)
-            else:
-                if self.state[e[0]] == 'N':
-                    edge_release.append(e)
-        # update graph_u
-        self.graph_u.add_edges_from(edge_release)
-        # update ban and states and restricted
-        for k in edges:
-            self.restricted_edge.pop(k)
-        for k in node_release:
-            self.restricted_node.pop(k)
-        self.ban.update({n:self.params['ban_time'] for n in node_release})  # -- when does it count down and remove?
-        self.state.update({n:'N' for n in node_release})
+        # ----- one step passes for self.restricted and self.ban, follow up graph_u, ban, and state update 
+        self.release_expired(ban=True)
 
         
         # ------ isolate new discovered infected
@@ -114,38 +167,10 @@ class MitigationStrategy():
             candidates = np.random.choice(candidates, self.params['restrict_candidate_budget'], replace=False)
         else:
             candidate = np.asarray(candidate)
-        for node in candidates:
-            # decision based on the graph we know
-            nn = list(self.graph_k.neighbors(node))
-            if len(nn) == 0:
-                continue
-            if len(nn) > self.params['restrict_candidate_neigh_budget']:
-                neighbors = list(np.random.choice(nn,
-                            size=self.params['restrict_candidate_neigh_budget'],replace=False)) 
-            else:
-                neighbors = nn
-            # severing ties in the graph that we don't know based on the node restrictions
-            rem_cand = [node]+neighbors
-            if len(set(rem_cand)) < 2:
-                continue
-            subg = nx.subgraph(self.graph_u, rem_cand)
-
-            rest_node_update = {n: self.params['restrict_time'] for n in rem_cand}
-            rest_edge_update = {i: self.params['restrict_time'] for n in rem_cand for i in list(self.graph_u.edges(n)) if \
-                                    n not in self.ban}
-            edges_all = list(rest_edge_update)
-            edges_rem = [e for e in edges_all if e not in subg.edges()]  # keep edges inside and isolate from outside
-            rest_edge_update = {k:v for k,v in rest_edge_update.items() if k in edges_rem}
-            # update graph_u
-            self.graph_u.remove_edges_from(edges_rem)
-            # update restricted, state
-            self.restricted_node.update(rest_node_update)
-            self.restricted_edge.update(rest_edge_update)
-            self.state.update({n:'Y' for n in rest_node_update})
-
+        self.fragment(self.restriction_groups(candidates), check_ban=True, check_state=False)
 
         # --- update history
-        self.history.append(self.state.copy())
+        self.history.step()
      
 
 
@@ -155,65 +180,38 @@ class MitigationStrategy():
             test_states: the state of nodes inferred by testing result over time {node:}
             test_latest_inf: the list of nodes that are identified as infected in this time [nodes_inf]
         '''
-        # ----- update time for self.restricted and follow up graph_u, ban, and state update 
-        # update time for already restricted edges
-        self.restricted_edge = {k: v-1 for k,v in self.restricted_edge.items()}
-        self.restricted_node = {k: v-1 for k,v in self.restricted_node.items()}
-        edges = [k for k,v in self.restricted_edge.items() if v < 1]  
-        node_release = [k for k,v in self.restricted_node.items() if v < 1]
-        edge_release = []
-        # we don't want the edges to be released if the other end is still in restriction
-        for e in edges: 
-            if e[0] in node_release:
-                if self.state[e[1]] == 'N':
-                    edge_release.append(e)
-            else:
-                if self.state[e[0]] == 'N':
-                    edge_release.append(e)
-        # update graph_u
-        self.graph_u.add_edges_from(edge_release)
-        # update ban and states and restricted
-        for k in edges:
-            self.restricted_edge.pop(k)
-        for k in node_release:
-            self.restricted_node.pop(k)
-        self.state.update({n:'N' for n in node_release})
+        # ----- one step passes for self.com_restricted and self.restricted_edge, follow up graph_u and state update 
+        # (all the members of an isolated community are restricted together, so they share the community time)
+        node_release = [n for k in self.com_restricted.tick() for n in self.clusters[k]]
+        self.release_edges(self.restricted_edge.tick(), node_release)
+        self.set_state(node_release, 'N')
 
+        # ------ calc comscore from the community counters (only the new test results are counted) and conditional isolation
+        self.update_counters(test_states)
+        with np.errstate(divide='ignore', invalid='ignore'):  # communities emptied by local moves
+            over = self.com_inf/self.com_members >= self.params['community_thr']
+        for k in np.flatnonzero(over).tolist():
+            members = self.clusters[k]
+            if len(set(members)) < 2:
+                continue
+            if k in self.com_restricted:  # still isolated, only its time starts over
+                self.com_restricted[k] = self.params['restrict_time']
+                continue
+            rem_set = set(members)
 
-        # ------ isolate new discovered infected
-        # rest_node_update = {n: self.params['restrict_time'] for n in test_latest_inf}
-        # rest_edge_update = {(n,neigh): self.params['restrict_time'] for n in test_latest_inf for neigh in self.graph_u.neighbors(n)}
-        # # update graph_u
-        # self.graph_u.remove_edges_from(list(rest_edge_update))
-        # # update restricted, ban, states
-        # self.restricted_edge.update(rest_edge_update)
-        # self.restricted_node.update(rest_node_update)
-        # self.state.update({n:'Y' for n in rest_node_update})
-
-        # ------ calc comscore and conditional isolation
-        for members in self.clusters.values():
-            num_inf = len([k for k in members if test_states.get(k,None)=='I'])
-            if num_inf/len(members) >= self.params['community_thr']:
-                rem_cand = members
-                if len(set(rem_cand)) < 2:
-                    continue
-                subg = nx.subgraph(self.graph_u, rem_cand)
-
-                rest_node_update = {n: self.params['restrict_time'] for n in rem_cand}
-                rest_edge_update = {i: self.params['restrict_time'] for n in rem_cand for i in list(self.graph_u.edges(n)) if \
-                                        self.state[n] == 'N'}
-                edges_all = list(rest_edge_update)
-                edges_rem = [e for e in edges_all if e not in subg.edges()]  # keep edges inside and isolate from outside
-                rest_edge_update = {k:v for k,v in rest_edge_update.items() if k in edges_rem}
-                # update graph_u
-                self.graph_u.remove_edges_from(edges_rem)
-                # update restricted, state
-                self.restricted_node.update(rest_node_update)
-                self.restricted_edge.update(rest_edge_update)
-                self.state.update({n:'Y' for n in rest_node_update})
+            rest_edge_update = {i: self.params['restrict_time'] for n in members if self.state[n] == 'N' \
+                                    for i in self.graph_u.edges(n)}
+            edges_rem = [e for e in rest_edge_update if not (e[0] in rem_set and e[1] in rem_set)]  # keep edges inside and isolate from outside
+            rest_edge_update = {k:v for k,v in rest_edge_update.items() if k in edges_rem}
+            # update graph_u
+            self.graph_u.remove_edges_from(edges_rem)
+            # update restricted, state
+            self.com_restricted[k] = self.params['restrict_time']
+            self.restricted_edge.update(rest_edge_update)
+            self.set_state(members, 'Y')
                 
         # --- update history
-        self.history.append(self.state.copy())
+        self.history.step()
 
     def run_degiso(self, test_states, test_latest_inf):
         '''
@@ -221,35 +219,8 @@ class MitigationStrategy():
             test_states: the state of nodes inferred by testing result over time {node:}
             test_latest_inf: the list of nodes that are identified as infected in this time [nodes_inf]
         '''
-        # ----- update time for self.restricted and self.ban and follow up graph_u, ban, and state update 
-        # update time for already banned nodes
-        self.ban = {k: v-1 for k,v in self.ban.items()}
-        rem = [k for k,v in self.ban.items() if v<1]
-        for k in rem:
-            self.ban.pop(k)
-        # update time for already restricted edges
-        self.restricted_edge = {k: v-1 for k,v in self.restricted_edge.items()}
-        self.restricted_node = {k: v-1 for k,v in self.restricted_node.items()}
-        edges = [k for k,v in self.restricted_edge.items() if v < 1]  
-        node_release = [k for k,v in self.restricted_node.items() if v < 1]
-        edge_release = []
-        # we don't want the edges to be released if the other end is still in restriction
-        for e in edges: 
-            if e[0] in node_release:
-                if self.state[e[1]] == 'N':
-                    edge_release.append(e)
-            else:
-                if self.state[e[0]] == 'N':
-                    edge_release.append(e)
-        # update graph_u
-        self.graph_u.add_edges_from(edge_release)
-        # update ban and states and restricted
-        for k in edges:
-            self.restricted_edge.pop(k)
-        for k in node_release:
-            self.restricted_node.pop(k)
-        self.ban.update({n:self.params['ban_time'] for n in node_release})  # -- when does it count down and remove?
-        self.state.update({n:'N' for n in node_release})
+        # ----- one step passes for self.restricted and self.ban, follow up graph_u, ban, and state update 
+        self.release_expired(ban=True)
 
         
         # ------ isolate new discovered infected
@@ -260,51 +231,22 @@ class MitigationStrategy():
         # update restricted, ban, states
         self.restricted_edge.update(rest_edge_update)
         self.restricted_node.update(rest_node_update)
-        self.state.update({n:'Y' for n in rest_node_update})
-        for n in set(list(rest_node_update)).intersection(set(list(self.ban))):
-            self.ban.pop(n)
+        self.set_state(rest_node_update, 'Y')
+        for n in rest_node_update:
+            self.ban.pop(n, None)
 
         
-        # ------ calc degscore
-        degscore = {node:self.graph_k.degree(node) for node in self.graph_k}
+        # ------ calc degscore, from the degree buckets of graph_k
+        thr = self.graph_k.degree_percentile(80)
         
         # ----- frag
-        thr = np.percentile(list(degscore.values()), 80)
-        sorted_scores = sorted([(k,v) for k,v in degscore.items() if v >= thr], key=lambda item: item[1], reverse=True)
         # pick top M with P neight, not in ban --> edges_rem
-        candidates = [i[0] for i in sorted_scores[:self.params['restrict_candidate_budget']]]
-        for node in candidates:
-            # decision based on the graph we know
-            nn = list(self.graph_k.neighbors(node))
-            if len(nn) == 0:
-                continue
-            if len(nn) > self.params['restrict_candidate_neigh_budget']:
-                neighbors = list(np.random.choice(nn,
-                            size=self.params['restrict_candidate_neigh_budget'],replace=False)) 
-            else:
-                neighbors = nn
-            # severing ties in the graph that we don't know based on the node restrictions
-            rem_cand = [node]+neighbors
-            if len(set(rem_cand)) < 2:
-                continue
-            subg = nx.subgraph(self.graph_u, rem_cand)
-
-            rest_node_update = {n: self.params['restrict_time'] for n in rem_cand}
-            rest_edge_update = {i: self.params['restrict_time'] for n in rem_cand for i in list(self.graph_u.edges(n)) if \
-                                    n not in self.ban and self.state[n] == 'N'}
-            edges_all = list(rest_edge_update)
-            edges_rem = [e for e in edges_all if e not in subg.edges()]  # keep edges inside and isolate from outside
-            rest_edge_update = {k:v for k,v in rest_edge_update.items() if k in edges_rem}
-            # update graph_u
-            self.graph_u.remove_edges_from(edges_rem)
-            # update restricted, state
-            self.restricted_node.update(rest_node_update)
-            self.restricted_edge.update(rest_edge_update)
-            self.state.update({n:'Y' for n in rest_node_update})
-
+        candidates = [n for n in self.graph_k.top_by_degree(self.params['restrict_candidate_budget']) \
+                      if self.graph_k.degree(n) >= thr]
+        self.fragment(self.restriction_groups(candidates), check_ban=True, check_state=True)
 
         # --- update history
-        self.history.append(self.state.copy())
+        self.history.step()
      
     def run_1hopiso(self, test_states, test_latest_inf):
         '''
@@ -312,29 +254,8 @@ class MitigationStrategy():
             test_states: the state of nodes inferred by testing result over time {node:}
             test_latest_inf: the list of nodes that are identified as infected in this time [nodes_inf]
         '''
-        # ----- update time for self.restricted and self.ban and follow up graph_u, ban, and state update 
-        # update time for already restricted edges
-        self.restricted_edge = {k: v-1 for k,v in self.restricted_edge.items()}
-        self.restricted_node = {k: v-1 for k,v in self.restricted_node.items()}
-        edges = [k for k,v in self.restricted_edge.items() if v < 1]  
-        node_release = [k for k,v in self.restricted_node.items() if v < 1]
-        edge_release = []
-        # we don't want the edges to be released if the other end is still in restriction
-        for e in edges: 
-            if e[0] in node_release:
-                if self.state[e[1]] == 'N':
-                    edge_release.append(e)
-            else:
-                if self.state[e[0]] == 'N':
-                    edge_release.append(e)
-        # update graph_u
-        self.graph_u.add_edges_from(edge_release)
-        # update ban and states and restricted
-        for k in edges:
-            self.restricted_edge.pop(k)
-        for k in node_release:
-            self.restricted_node.pop(k)
-        self.state.update({n:'N' for n in node_release})
+        # ----- one step passes for self.restricted, follow up graph_u and state update 
+        self.release_expired(ban=False)
 
         
         # ------ isolate new discovered infected
@@ -355,38 +276,10 @@ class MitigationStrategy():
         sorted_scores = sorted([(k,v) for k,v in degscore.items()], key=lambda item: item[1], reverse=True)
         # pick top M with P neight, not in ban --> edges_rem
         candidates = [i[0] for i in sorted_scores[:self.params['restrict_candidate_budget']]]
-        for node in candidates:
-            # decision based on the graph we know
-            nn = list(self.graph_k.neighbors(node))
-            if len(nn) == 0:
-                continue
-            if len(nn) > self.params['restrict_candidate_neigh_budget']:
-                neighbors = list(np.random.choice(nn,
-                            size=self.params['restrict_candidate_neigh_budget'],replace=False)) 
-            else:
-                neighbors = nn
-            # severing ties in the graph that we don't know based on the node restrictions
-            rem_cand = [node]+neighbors
-            if len(set(rem_cand)) < 2:
-                continue
-            subg = nx.subgraph(self.graph_u, rem_cand)
-
-            rest_node_update = {n: self.params['restrict_time'] for n in rem_cand}
-            rest_edge_update = {i: self.params['restrict_time'] for n in rem_cand for i in list(self.graph_u.edges(n)) if \
-                                    self.state[n] == 'N'}
-            edges_all = list(rest_edge_update)
-            edges_rem = [e for e in edges_all if e not in subg.edges()]  # keep edges inside and isolate from outside
-            rest_edge_update = {k:v for k,v in rest_edge_update.items() if k in edges_rem}
-            # update graph_u
-            self.graph_u.remove_edges_from(edges_rem)
-            # update restricted, state
-            self.restricted_node.update(rest_node_update)
-            self.restricted_edge.update(rest_edge_update)
-            self.state.update({n:'Y' for n in rest_node_update})
-
+        self.fragment(self.restriction_groups(candidates), check_ban=False, check_state=True)
 
         # --- update history
-        self.history.append(self.state.copy())
+        self.history.step()
       
     def run_commit(self, test_states, test_latest_inf):
         '''
@@ -394,35 +287,8 @@ class MitigationStrategy():
             test_states: the state of nodes inferred by testing result over time {node:}
             test_latest_inf: the list of nodes that are identified as infected in this time [nodes_inf]
         '''
-        # ----- update time for self.restricted and self.ban and follow up graph_u, ban, and state update 
-        # update time for already banned nodes
-        self.ban = {k: v-1 for k,v in self.ban.items()}
-        rem = [k for k,v in self.ban.items() if v<1]
-        for k in rem:
-            self.ban.pop(k)
-        # update time for already restricted edges
-        self.restricted_edge = {k: v-1 for k,v in self.restricted_edge.items()}
-        self.restricted_node = {k: v-1 for k,v in self.restricted_node.items()}
-        edges = [k for k,v in self.restricted_edge.items() if v < 1]  
-        node_release = [k for k,v in self.restricted_node.items() if v < 1]
-        edge_release = []
-        # we don't want the edges to be released if the other end is still in restriction
-        for e in edges: 
-            if e[0] in node_release:
-                if self.state[e[1]] == 'N':
-                    edge_release.append(e)
-            else:
-                if self.state[e[0]] == 'N':
-                    edge_release.append(e)
-        # update graph_u
-        self.graph_u.add_edges_from(edge_release)
-        # update ban and states and restricted
-        for k in edges:
-            self.restricted_edge.pop(k)
-        for k in node_release:
-            self.restricted_node.pop(k)
-        self.ban.update({n:self.params['ban_time'] for n in node_release})  # -- when does it count down and remove?
-        self.state.update({n:'N' for n in node_release})
+        # ----- one step passes for self.restricted and self.ban, follow up graph_u, ban, and state update 
+        self.release_expired(ban=True)
 
         
         # ------ isolate new discovered infected
@@ -433,85 +299,173 @@ class MitigationStrategy():
         # update restricted, ban, states
         self.restricted_edge.update(rest_edge_update)
         self.restricted_node.update(rest_node_update)
-        self.state.update({n:'Y' for n in rest_node_update})
-        for n in set(list(rest_node_update)).intersection(set(list(self.ban))):
-            self.ban.pop(n)
+        self.set_state(rest_node_update, 'Y')
+        for n in rest_node_update:
+            self.ban.pop(n, None)
 
         
-        # ------ calc cscore and nscore
+        # ------ calc cscore and nscore (in variant B the nscore of a node is the cscore of its community)
         self.set_Cscore(test_states)
-        self.set_Nscore()
         
         # ----- frag
-        thr = np.percentile(list(self.Nscore.values()), 80)
-        sorted_scores = sorted([(k,v) for k,v in self.Nscore.items() if v >= thr], key=lambda item: item[1], reverse=True)
         # pick top M with P neight, not in ban --> edges_rem
-        candidates = [i[0] for i in sorted_scores[:self.params['restrict_candidate_budget']]]
-        for node in candidates:
-            # decision based on the graph we know
-            nn = list(self.graph_k.neighbors(node))
-            if len(nn) == 0:
-                continue
-            if len(nn) > self.params['restrict_candidate_neigh_budget']:
-                neighbors = list(np.random.choice(nn,
-                            size=self.params['restrict_candidate_neigh_budget'],replace=False)) 
+        if self.params['nscore'] == 'B':
+            candidates = self.top_candidates(self.params['restrict_candidate_budget'])
+        else:
+            self.set_Nscore()
+            thr = np.percentile(list(self.Nscore.values()), 80)
+            sorted_scores = sorted([(k,v) for k,v in self.Nscore.items() if v >= thr], key=lambda item: item[1], reverse=True)
+            candidates = [i[0] for i in sorted_scores[:self.params['restrict_candidate_budget']]]
+        self.fragment(self.restriction_groups(candidates), check_ban=True, check_state=True)
+
+        # --- update history
+        self.history.step()
+        
+    def update_counters(self, test_states):
+        ''' count the edges added to (or removed from) graph_k and the test results changed since the last call '''
+        graph, pos = self.edge_cursor
+        touched = {}  # nodes whose edges changed, ordered
+        if graph is not self.graph_k:  # new graph_k, count it from the start
+            touched = dict.fromkeys(self.graph_k)
+            self.node_pos = {n:i for i,n in enumerate(self.graph_k)}
+            self.com_order = {k:sorted([n for n in self.clusters[k] if n in self.node_pos], key=self.node_pos.get) \
+                              for k in self.clusters}
+            self.com_size = np.asarray([len(self.com_order[k]) for k in self.clusters])
+            self.com_inside[:] = 0
+            self.com_boundary[:] = 0
+            pos = 0
+        for u, v, sign in self.graph_k.edge_log[pos:]:
+            touched[u] = touched[v] = None
+            cu, cv = self.node_cluster[u], self.node_cluster[v]
+            if cu == cv:
+                self.com_inside[cu] += sign
             else:
-                neighbors = nn
-            # severing ties in the graph that we don't know based on the node restrictions
-            rem_cand = [node]+neighbors
-            if len(set(rem_cand)) < 2:
-                continue
-            subg = nx.subgraph(self.graph_u, rem_cand)
+                self.com_boundary[cu] += sign
+                self.com_boundary[cv] += sign
+        self.edge_cursor = (self.graph_k, len(self.graph_k.edge_log))
+        states, pos = self.state_cursor
+        if isinstance(test_states, LatestStates) and states is test_states:
+            changed = test_states.log[pos:]
+        else:  # not seen before, count it from the start
+            self.com_inf[:] = 0
+            self.test_inf = set()
+            changed = list(test_states)
+        for n in changed:
+            inf = test_states.get(n, None) == 'I'
+            if inf != (n in self.test_inf):
+                self.com_inf[self.node_cluster[n]] += 1 if inf else -1
+                if inf:
+                    self.test_inf.add(n)
+                else:
+                    self.test_inf.remove(n)
+        self.state_cursor = (test_states, len(test_states.log) if isinstance(test_states, LatestStates) else 0)
+        if self.params['online_coms']:
+            self.local_moves(touched)
 
-            rest_node_update = {n: self.params['restrict_time'] for n in rem_cand}
-            rest_edge_update = {i: self.params['restrict_time'] for n in rem_cand for i in list(self.graph_u.edges(n)) if \
-                                    n not in self.ban and self.state[n] == 'N'}
-            edges_all = list(rest_edge_update)
-            edges_rem = [e for e in edges_all if e not in subg.edges()]  # keep edges inside and isolate from outside
-            rest_edge_update = {k:v for k,v in rest_edge_update.items() if k in edges_rem}
-            # update graph_u
-            self.graph_u.remove_edges_from(edges_rem)
-            # update restricted, state
-            self.restricted_node.update(rest_node_update)
-            self.restricted_edge.update(rest_edge_update)
-            self.state.update({n:'Y' for n in rest_node_update})
+    def local_moves(self, nodes):
+        '''
+        incremental community detection on graph_k (the local moving phase of louvain): only the
+        given nodes, and then the neighbors of the nodes that move, are visited. A node moves to
+        the neighbor community of the best modularity gain, the counters follow each move.
+        The communities isolated by comiso are left as they are.
+        '''
+        m2 = 2*self.graph_k.num_edges
+        if m2 == 0:
+            return
+        queue = deque(n for n in nodes if n in self.graph_k)
+        queued = set(queue)
+        while queue:
+            n = queue.popleft()
+            queued.remove(n)
+            own = self.node_cluster[n]
+            if own in self.com_restricted:
+                continue
+            links = {}  # {cluster_id: edges of n to the cluster}
+            for w in self.graph_k[n]:
+                if w != n:
+                    c = self.node_cluster[w]
+                    links[c] = links.get(c, 0) + 1
+            deg = self.graph_k.degree(n)
+            # modularity gain times 2m (exact integers), the node itself taken out of its community
+            best = own
+            gain = links.get(own, 0)*m2 - deg*(2*int(self.com_inside[own]) + int(self.com_boundary[own]) - deg)
+            for c, l in links.items():
+                if c == own or c in self.com_restricted:
+                    continue
+                g = l*m2 - deg*(2*int(self.com_inside[c]) + int(self.com_boundary[c]))
+                if g > gain:
+                    best, gain = c, g
+            if best != own:
+                self.move_node(n, best)
+                for w in self.graph_k[n]:
+                    if w not in queued and self.node_cluster[w] != best:
+                        queue.append(w)
+                        queued.add(w)
 
+    def move_node(self, n, k):
+        ''' move node n to community k, keeping clusters, node_cluster and the community counters '''
+        old = self.node_cluster[n]
+        for w in self.graph_k[n]:
+            if w == n:  # a self loop is inside whichever community n is in
+                self.com_inside[old] -= 1
+                self.com_inside[k] += 1
+                continue
+            c = self.node_cluster[w]
+            # the edge is taken out of the old community and put in the new one
+            if c == old:
+                self.com_inside[old] -= 1
+            else:
+                self.com_boundary[old] -= 1
+                self.com_boundary[c] -= 1
+            if c == k:
+                self.com_inside[k] += 1
+            else:
+                self.com_boundary[k] += 1
+                self.com_boundary[c] += 1
+        del self.clusters[old][n]
+        self.clusters[k][n] = None
+        self.node_cluster[n] = k
+        self.com_members[old] -= 1
+        self.com_members[k] += 1
+        if n in self.node_pos:
+            self.com_size[old] -= 1
+            self.com_size[k] += 1
+            self.com_order[old].remove(n)
+            bisect.insort(self.com_order[k], n, key=self.node_pos.get)
+        if n in self.test_inf:
+            self.com_inf[old] -= 1
+            self.com_inf[k] += 1
+        if n in self.blocked:
+            self.com_blocked[old] -= 1
+            self.com_blocked[k] += 1
 
-        # --- update history
-        self.history.append(self.state.copy())
-        
-    def get_community_score(self, com_graph, test_states):
+    def set_Cscore(self, test_states):
         '''
         Cscore = (normalized size + infected ratio + separability)/(1+1+1)
         separability = (intra_neighbor_edges - inter_neighbor_edges)/all edges in the graph
-        NOTE: changes in com_graph and graph_k are linked! (com_graph is subgraph of graph_k)
+        computed for all the communities at once from the counters
         '''
-        # normalized size
-        cnodes = com_graph.number_of_nodes()
-        normalized_size = cnodes/self.graph_k.number_of_nodes()
-        # infected ratio
-        infected = [n for n in com_graph.nodes() if test_states.get(n, None)=='I']
-        infected_ratio = len(infected)/cnodes
-        # separability
-        if self.graph_k.number_of_edges() == 0:
-            return (normalized_size+infected_ratio)/2
-        edges_inside = com_graph.number_of_edges()
-        edges_outside = sum([self.graph_k.degree(n) - com_graph.degree(n) for n in com_graph])
-        separability = (edges_inside - edges_outside)/self.graph_k.number_of_edges()
-        return (normalized_size+infected_ratio+separability)/3
-    
-    def set_Cscore(self, test_states):
-        self.Cscore = {k:self.get_community_score(self.com_graphs[k], test_states) for k in self.com_graphs}
+        self.update_counters(test_states)
+        normalized_size = self.com_size/self.graph_k.number_of_nodes()
+        with np.errstate(divide='ignore', invalid='ignore'):  # communities with no known members (scored nan)
+            infected_ratio = self.com_inf/self.com_size
+        if self.graph_k.num_edges == 0:
+            scores = (normalized_size+infected_ratio)/2
+        else:
+            separability = (self.com_inside - self.com_boundary)/self.graph_k.num_edges
+            scores = (normalized_size+infected_ratio+separability)/3
+        self.Cscore = dict(zip(self.clusters, scores.tolist()))
         
     def get_neighborhood_connectivity(self,node):
         # edges between neighbors/(edges between neighbors + edges from neighbors to outside)
-        nodes = [node] + [i for i in self.graph_k.neighbors(node)]
-        if len(nodes) == 1:  #-----------------------> we can make isolated nodes among unvisited nodes
+        # from the triangle and neighbor degree counts that graph_k keeps up to date
+        degree = self.graph_k.loopless_degree(node)
+        if degree == 0:  #-----------------------> we can make isolated nodes among unvisited nodes
             return 0
-        subgraph = nx.subgraph(self.graph_k,nodes)
         # only count edges between neighbors and not to the node
-        edges_inside = subgraph.number_of_edges() - subgraph.degree(node) # 0 if neighbors not connected at all
-        edges_outside = sum([self.graph_k.degree(n) - subgraph.degree(n) for n in subgraph if n != node])
+        edges_inside = self.graph_k.triangles[node] # 0 if neighbors not connected at all
+        # degrees of the neighbors minus their edges to the node and to each other
+        edges_outside = self.graph_k.nbr_degree[node] - degree - 2*edges_inside
         if edges_inside ==0 and edges_outside ==0: # e.g, node has one neightbor and neighbor has only the one edge to the node
             return 0
         return edges_inside/(edges_inside + edges_outside)
@@ -525,23 +479,163 @@ class MitigationStrategy():
         nscore = (cscore (of the community of the node) + neigh_connectivity)/2 
             if node not in ban, or already restricted
         '''
-        # A: self.Nscore = {node: self.graph_k.degree(node)/self.graph_k.number_of_nodes() for \
-        #                 node in self.graph_k if node not in self.ban and self.state[node] == 'N'}
-        # B: 
-        self.Nscore = {node: self.Cscore[self.node_cluster[node]] for \
-                        node in self.graph_k if node not in self.ban and self.state[node] == 'N'}
-        # C: self.Nscore = {node: (self.Cscore[self.node_cluster[node]]+ \
-        #                 self.get_neighborhood_connectivity(node))/2 for \
-        #                 node in self.graph_k if node not in self.ban and self.state[node] == 'N'}
+        if self.params['nscore'] == 'A':
+            self.Nscore = {node: self.graph_k.degree(node)/self.graph_k.number_of_nodes() for \
+                            node in self.graph_k if node not in self.ban and self.state[node] == 'N'}
+        elif self.params['nscore'] == 'C':
+            self.Nscore = {node: (self.Cscore[self.node_cluster[node]]+ \
+                            self.get_neighborhood_connectivity(node))/2 for \
+                            node in self.graph_k if node not in self.ban and self.state[node] == 'N'}
+        else:  # B
+            self.Nscore = {node: self.Cscore[self.node_cluster[node]] for \
+                            node in self.graph_k if node not in self.ban and self.state[node] == 'N'}
         # NOTE: B > A > C in terms of duration of infection, in terms of budget, they are almost similar.
         
+    def restriction_groups(self, candidates):
+        ''' [candidate + up to P of its known neighbors drawn at random] for each candidate that has neighbors '''
+        groups = []
+        for node in candidates:
+            # decision based on the graph we know
+            nn = list(self.graph_k.neighbors(node))
+            if len(nn) == 0:
+                continue
+            if len(nn) > self.params['restrict_candidate_neigh_budget']:
+                neighbors = list(np.random.choice(nn,
+                            size=self.params['restrict_candidate_neigh_budget'],replace=False)) 
+            else:
+                neighbors = nn
+            rem_cand = [node]+neighbors
+            if len(set(rem_cand)) < 2:
+                continue
+            groups.append(rem_cand)
+        return groups
+
+    def fragment(self, groups, check_ban=True, check_state=True):
+        '''
+        severing ties in the graph that we don't know based on the node restrictions: every group keeps
+        the edges inside and is isolated from outside, for all the groups of the round at once.
+        Same as restricting the groups one after the other: a node only cuts its edges if it is not
+        banned (check_ban) and not restricted yet (check_state, also by an earlier group of the round),
+        and an edge is cut (and timed) by the first group that cuts it.
+        '''
+        if len(groups) == 0:
+            return
+        topo = self.graph_u.topo
+        nodes = [n for g in groups for n in g]
+        idx = np.asarray([topo.index[n] for n in nodes], dtype=np.int64)
+        gid = np.repeat(np.arange(len(groups)), [len(g) for g in groups])
+        cuts = np.ones(len(idx), dtype=bool)  # the members that cut their edges
+        if check_state:
+            _, first = np.unique(idx, return_index=True)
+            cuts[:] = False
+            cuts[first] = True
+            cuts &= ~self.graph_u.node_mask[idx]
+        if check_ban:
+            cuts &= np.asarray([n not in self.ban for n in nodes], dtype=bool)
+        rows = np.flatnonzero(cuts)
+        owner, slots = topo.expand(idx[rows])
+        eids = topo.eid[slots]
+        # open edges of the members to nodes outside of their group
+        num_nodes = topo.number_of_nodes()
+        outside = ~np.isin(gid[rows][owner]*num_nodes + topo.indices[slots], gid*num_nodes + idx)
+        rem = np.flatnonzero(self.graph_u.edge_mask[eids] & outside)
+        _, first = np.unique(eids[rem], return_index=True)
+        rem = rem[np.sort(first)]
+        # update graph_u
+        self.graph_u.remove_edge_ids(eids[rem])
+        # update restricted, state
+        edges_rem = zip(topo.nodes[idx[rows][owner[rem]]].tolist(), topo.nodes[topo.indices[slots[rem]]].tolist())
+        self.restricted_node.update({n: self.params['restrict_time'] for n in nodes})
+        self.restricted_edge.update({e: self.params['restrict_time'] for e in edges_rem})
+        self.set_state(nodes, 'Y')
+
+    def release_expired(self, ban=True):
+        '''
+        one step passes for the timers: the expired bans are dropped, the nodes whose restriction
+        is over are released (and banned for ban_time if ban) and the expired edges are put back on
+        '''
+        if ban:
+            self.update_blocked(self.ban.tick())
+        edges = self.restricted_edge.tick()
+        node_release = self.restricted_node.tick()
+        self.release_edges(edges, node_release)
+        if ban:
+            self.ban.update({n:self.params['ban_time'] for n in node_release})
+        self.set_state(node_release, 'N')
+
+    def release_edges(self, edges, node_release):
+        '''
+        put back the expired edges, all at once with the node mask of graph_u (states before node_release)
+        we don't want the edges to be released if the other end is still in restriction: the second end decides
+        when the first end is released now, else the first end
+        '''
+        if len(edges) == 0:
+            return
+        index = self.graph_u.topo.index
+        ends = np.asarray([(index[u], index[v]) for u,v in edges], dtype=np.int64)
+        first_released = np.isin(ends[:,0], np.asarray([index[n] for n in node_release], dtype=np.int64))
+        decide = np.where(first_released, ends[:,1], ends[:,0])
+        keep = ~self.graph_u.node_mask[decide]
+        self.graph_u.add_edges_from([e for e,k in zip(edges, keep.tolist()) if k])
+
+    def top_candidates(self, budget, q=80):
+        '''
+        top nodes by nscore (variant B) among those with nscore >= its q-th percentile, from the
+        communities ranked by cscore: banned or restricted nodes are skipped as they come, ties
+        between communities of the same score are merged in graph_k node order
+        '''
+        eligible = self.com_size - self.com_blocked
+        scores = np.asarray([self.Cscore[k] for k in self.clusters])
+        levels, inv = np.unique(scores, return_inverse=True)
+        weights = np.bincount(inv, weights=eligible, minlength=len(levels))  # eligible nodes of each score
+        if not weights.any():
+            return []
+        thr = percentile_of_counts(levels[weights > 0], weights[weights > 0], q)
+        ranked = np.argsort(-scores, kind='stable')
+        ranked = ranked[(eligible[ranked] > 0) & (scores[ranked] >= thr)]
+        candidates = []
+        # communities of the same score are consecutive in ranked
+        for coms in np.split(ranked, np.flatnonzero(np.diff(scores[ranked])) + 1):
+            if len(candidates) == budget:
+                break
+            members = heapq.merge(*[self.com_order[k] for k in coms.tolist()], key=self.node_pos.get)
+            for n in members:
+                if len(candidates) == budget:
+                    break
+                if n not in self.blocked:
+                    candidates.append(n)
+        return candidates
+
+    def update_blocked(self, nodes):
+        ''' nodes: nodes whose ban or restriction may have changed '''
+        for n in nodes:
+            blocked = n in self.ban or self.state[n] == 'Y'
+            if blocked != (n in self.blocked):
+                self.com_blocked[self.node_cluster[n]] += 1 if blocked else -1
+                if blocked:
+                    self.blocked.add(n)
+                else:
+                    self.blocked.remove(n)
+
+    def set_state(self, nodes, state):
+        # 'Y': restricted, 'N': not restricted, mirrored in the node mask of graph_u and logged in history
+        changed = [n for n in nodes if self.state[n] != state]
+        self.state.update({n:state for n in nodes})
+        if state == 'Y':
+            self.graph_u.restrict_nodes(nodes)
+            self.history.restrict(changed)
+        else:
+            self.graph_u.release_nodes(nodes)
+            self.history.release(changed)
+        self.update_blocked(changed)
+
     def get_graph_u(self):
         return self.graph_u
         
     def set_graph_k(self, g):
-        self.graph_k = g
-        # update com_graphs
-        self.com_graphs = {k:nx.subgraph(self.graph_k,self.clusters[k]) for k in self.clusters}
+        if g is self.graph_k:  # the community counters follow its edge log, already up to date
+            return
+        self.graph_k = g if isinstance(g, KnownGraph) else KnownGraph(g)  # counted from the start at the next Cscore
 
     def get_history(self):
         return self.history
@@ -0,0 +1,69 @@
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+
+from utils import load_data_cached
+from cache import load_cell, save_cell
+
+
+@lru_cache(maxsize=None)
+def load_dataset(path):
+    '''
+    topo (GraphState), sources, clusters of a dataset from its memory-mapped binary cache (see
+    utils.load_data_cached), once per process (the workers forked from the main process inherit
+    what it has loaded, the pages of the arrays are shared). The graphs are shared read-only by
+    all the tasks and parameter points, topo.graph is the networkx graph (built on first use).
+    '''
+    return load_data_cached(path)
+
+
+def seed_task(seed, *key):
+    '''
+    seed the global numpy random state for one task from the base seed and the task key
+    (e.g., dataset, parameter values, source set), so a task draws the same numbers whatever
+    process runs it and in whatever order
+    '''
+    spawn_key = tuple(zlib.crc32(str(k).encode()) for k in key)
+    np.random.seed(np.random.SeedSequence(seed, spawn_key=spawn_key).generate_state(4))
+
+
+def call(task):
+    ''' run a task and save its result in its cache cell (if any) as soon as it is done '''
+    cell, fn, *params = task
+    result = fn(*params)
+    if cell is not None:
+        save_cell(cell, result)
+    return result
+
+
+def run_jobs(jobs, workers):
+    '''
+    input:
+        - jobs: [(writer, [(cache cell, fn, *params)])], each task fn(*params) returns a list of hist
+          items that are appended to the writer of its job (see results.open_output), and kept
+          in its cache cell (see cache.cell_path)
+        - workers: number of processes, the tasks run in this process if < 2
+    The tasks whose cell is already cached are not run again, the rest are spread over one pool.
+    The hist items are written in task order as soon as they are gathered, each writer is closed
+    once all the tasks of its job are done.
+    '''
+    tasks = [task for _, job_tasks in jobs for task in job_tasks]
+    cached = [task[0] is not None and os.path.exists(task[0]) for task in tasks]
+    todo = [task for task, hit in zip(tasks, cached) if not hit]
+    if len(todo) < len(tasks):
+        print(f'{len(tasks) - len(todo)} of {len(tasks)} tasks found in the cache.')
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 and todo else None
+    try:
+        results = pool.map(call, todo) if pool else map(call, todo)
+        hits = iter(cached)
+        for writer, job_tasks in jobs:
+            for task in job_tasks:
+                for item in load_cell(task[0]) if next(hits) else next(results):
+                    writer.append(item)
+            writer.close()
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
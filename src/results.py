@@ -0,0 +1,213 @@
+import json
+import os
+import pickle
+
+import numpy as np
+
+from cache import dataset_hash
+from history import SpreadHistory, RestrictionHistory, TestHistory
+from parallel import load_dataset
+
+HISTORIES = {'shist': SpreadHistory, 'thist': TestHistory, 'mhist': RestrictionHistory}
+
+
+def open_output(args, save_file, path):
+    '''
+    input:
+        - save_file: file of the result (see sweep.point_path)
+        - path: dataset file
+    output:
+        - writer that the hist items of the result are appended to, in the format of args.format
+    '''
+    if args.format == 'pkl':
+        return PickleWriter(save_file, args, load_dataset(path)[0].graph)
+    # the graph is saved once per dataset, next to the mode directories
+    graph_dir = os.path.join(args.spath, 'graphs')
+    graph_file = os.path.join(graph_dir, f'{os.path.basename(path).split(".pkl")[0]}_{dataset_hash(path)[:12]}.pkl')
+    if not os.path.exists(graph_file):
+        os.makedirs(graph_dir, exist_ok=True)
+        with open(graph_file, 'wb') as f:
+            pickle.dump(load_dataset(path)[0].graph, f)
+    return ResultWriter(save_file, args, graph_file)
+
+
+def load_output(save_file):
+    ''' the result in the pickle format {args: , graph_u: , hist: [{shist: , ...}]}, whatever format it was saved in '''
+    if os.path.isdir(save_file):
+        reader = ResultReader(save_file)
+        return {'args': reader.args, 'graph_u': reader.graph(), 'hist': [reader.source(i) for i in range(len(reader))]}
+    with open(save_file, 'rb') as f:
+        return pickle.load(f)
+
+
+class PickleWriter():
+    ''' {args: , graph_u: , hist: [...]} kept in memory and pickled at once on close '''
+    def __init__(self, save_file, args, graph):
+        self.save_file = save_file
+        self.output = {'args': vars(args).copy(), 'graph_u': graph, 'hist': []}
+
+    def append(self, item):
+        self.output['hist'].append(item)
+
+    def close(self):
+        with open(self.save_file, 'wb') as f:
+            pickle.dump(self.output, f)
+
+
+class ResultWriter():
+    '''
+    Streaming, columnar form of a result: a directory with one raw typed array file per column
+    (e.g. shist.changed.bin) that every source set is appended to as soon as it is done, and
+    meta.json with the args, the graph file, the dtype of the columns (and which hold numbers) and
+    the rows [start, stop) of each source set in each column. The columns are the compact pickled forms of the histories
+    (see history.py): arrays as they are, numbers as one row, dicts as .keys and .values columns.
+    meta.json is rewritten after each source set, so it only lists the complete ones.
+    '''
+    def __init__(self, save_file, args, graph_file):
+        self.path = save_file
+        os.makedirs(self.path, exist_ok=True)
+        for name in os.listdir(self.path):  # overwrite an older result
+            if name.endswith('.bin') or name == 'meta.json':
+                os.remove(os.path.join(self.path, name))
+        self.meta = {'args': vars(args).copy(), 'graph': os.path.relpath(graph_file, self.path),
+                     'columns': {}, 'scalars': [], 'sources': [], 'complete': False}
+        self.rows = {}  # {column: rows written}
+        self.write_meta()
+
+    def append(self, item):
+        ''' item: {shist: , thist: , mhist: } of one source set '''
+        rows = {}
+        for key, hist in item.items():
+            for field, value in hist.__getstate__().items():
+                for column, array in self.columns(f'{key}.{field}', value):
+                    dtype = self.meta['columns'].setdefault(column, array.dtype.str)
+                    with open(os.path.join(self.path, column + '.bin'), 'ab') as f:
+                        f.write(np.ascontiguousarray(array, dtype=dtype).tobytes())
+                    start = self.rows.get(column, 0)
+                    self.rows[column] = start + len(array)
+                    rows[column] = [start, self.rows[column]]
+        self.meta['sources'].append(rows)
+        self.write_meta()
+
+    def columns(self, column, value):
+        if isinstance(value, dict):
+            dtype = None if value else np.int64
+            yield column + '.keys', np.asarray(list(value.keys()), dtype=dtype)
+            yield column + '.values', np.asarray(list(value.values()), dtype=dtype)
+        elif isinstance(value, np.ndarray) and value.ndim == 1:
+            yield column, value
+        elif np.isscalar(value):
+            if column not in self.meta['scalars']:
+                self.meta['scalars'].append(column)
+            yield column, np.asarray([value])
+        else:
+            raise TypeError(f'Column {column} can not be written as an array.')
+
+    def close(self):
+        self.meta['complete'] = True
+        self.write_meta()
+
+    def write_meta(self):
+        tmp = os.path.join(self.path, 'meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, os.path.join(self.path, 'meta.json'))
+
+
+class ResultReader():
+    '''
+    Reads a result saved by ResultWriter: the columns are memory-mapped, so one source set or a
+    time window of it is read without loading the rest of the file.
+    '''
+    def __init__(self, save_file):
+        self.path = save_file
+        with open(os.path.join(self.path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.args = self.meta['args']
+
+    def __len__(self):
+        return len(self.meta['sources'])
+
+    def graph(self):
+        with open(os.path.join(self.path, self.meta['graph']), 'rb') as f:
+            return pickle.load(f)
+
+    def column(self, i, column, start=0, stop=None):
+        ''' rows [start, stop) of source set i in the column (relative to the source set) '''
+        first, last = self.meta['sources'][i][column]
+        start, stop, _ = slice(start, stop).indices(last - first)
+        dtype = np.dtype(self.meta['columns'][column])
+        if stop <= start:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(os.path.join(self.path, column + '.bin'), dtype=dtype, mode='r',
+                         offset=(first + start)*dtype.itemsize, shape=(stop - start,))
+
+    def state(self, i, key):
+        ''' the compact pickled form of history key of source set i '''
+        state = {}
+        for column in self.meta['sources'][i]:
+            hist, field = column.split('.', 1)
+            if hist != key:
+                continue
+            if field.endswith('.keys'):
+                field = field[:-5]
+                state[field] = dict(zip(self.column(i, column).tolist(), self.column(i, f'{key}.{field}.values').tolist()))
+            elif not field.endswith('.values'):
+                array = np.array(self.column(i, column))
+                state[field] = array[0].item() if column in self.meta['scalars'] else array
+        return state
+
+    def source(self, i):
+        ''' {shist: , thist: , mhist: } of source set i '''
+        item = {}
+        for key in dict.fromkeys(column.split('.', 1)[0] for column in self.meta['sources'][i]):
+            hist = HISTORIES[key].__new__(HISTORIES[key])
+            hist.__setstate__(self.state(i, key))
+            item[key] = hist
+        return item
+
+    def spread_window(self, i, t0, t1):
+        '''
+        output:
+            - nodes, and the (t1-t0+1 x nodes) matrix of the state codes at times t0..t1 of source set i
+              (only the changes up to t1 are read)
+        '''
+        nodes = np.array(self.column(i, 'shist.nodes'))
+        codes = np.array(self.column(i, 'shist.initial'))
+        offsets = np.array(self.column(i, 'shist.offsets'))
+        t1 = min(t1, len(offsets) - 1)
+        changed = np.array(self.column(i, 'shist.changed', 0, offsets[t1]))
+        new_states = np.array(self.column(i, 'shist.new_states', 0, offsets[t1]))
+        window = []
+        for t in range(t1 + 1):
+            if t > 0:
+                codes[changed[offsets[t-1]:offsets[t]]] = new_states[offsets[t-1]:offsets[t]]
+            if t >= t0:
+                window.append(codes.copy())
+        return nodes, np.asarray(window).reshape(-1, len(nodes))
+
+    def test_window(self, i, r0, r1):
+        ''' [(tested nodes, their state codes)] of rounds r0..r1 of source set i '''
+        nodes = self.column(i, 'thist.nodes')
+        offsets = np.array(self.column(i, 'thist.offsets'))
+        r1 = min(r1, len(offsets) - 2)
+        tested = np.array(self.column(i, 'thist.tested', offsets[r0], offsets[r1+1]))
+        results = np.array(self.column(i, 'thist.results', offsets[r0], offsets[r1+1]))
+        bounds = offsets[r0:r1+2] - offsets[r0]
+        return [(np.asarray(nodes[tested[a:b]]), results[a:b]) for a,b in zip(bounds[:-1], bounds[1:])]
+
+    def restriction_window(self, i, t0, t1):
+        '''
+        output:
+            - nodes, and the (t1-t0+1 x nodes) boolean matrix of the restricted nodes at times t0..t1
+              of source set i
+        '''
+        nodes = np.array(self.column(i, 'mhist.nodes'))
+        t1 = min(t1, int(self.column(i, 'mhist.length')[0]) - 1)
+        node, start, end = [np.array(self.column(i, f'mhist.{c}')) for c in ('node', 'start', 'end')]
+        times = np.arange(t0, t1 + 1)[:, None]
+        window = np.zeros((len(times), len(nodes)), dtype=bool)
+        hit = (start[None, :] <= times) & (times < end[None, :])
+        rows, cols = np.nonzero(hit)
+        window[rows, node[cols]] = True
+        return nodes, window
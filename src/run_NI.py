@@ -1,8 +1,11 @@
 import os
-import pickle
 
-from utils import load_data
-from contagion_model import ContagionModel
+from utils import repeat_sources
+from contagion_model import ENGINES, EnsembleContagionModel
+from parallel import load_dataset, run_jobs, seed_task
+from sweep import point_path, write_index
+from cache import cell_path
+from results import open_output
 
 
 def run_NI(args):
@@ -11,7 +14,8 @@ def run_NI(args):
     save2 = os.path.join(args.spath, dirname)
     if not os.path.exists(save2):
         os.makedirs(save2)
-    # loop over data
+    # loop over data, the source sets of all the datasets are run as the tasks of one pool
+    jobs, entries = [], []
     for root, _, files in os.walk(args.dpath):
         for file in files:
             save2 = os.path.join(args.spath, dirname)
@@ -19,28 +23,66 @@ def run_NI(args):
             save2 = os.path.join(save2, file_name)
             if not os.path.exists(save2):
                 os.mkdir(save2)
+            path = os.path.join(root, file)
             print(f'############## NI: {file_name} #############')
-            G_u0, _, sources, _ = load_data(os.path.join(root, file))
-            # {args: , graph_u: , hist: [{thist1: }, {thist2: },..., {thist3:}] }
-            output = {'args': vars(args).copy(), 'graph_u': G_u0.copy(), 'hist': []}
-            # loop over sources
-            count = 0
-            for source in sources:
-                count += 1
-                G_u = G_u0.copy()
-                # initialization
-                states = {k:'S' for k in G_u.nodes()}
-                states.update({k:'I' for k in source})
-                spread = ContagionModel(graph = G_u, states = states, model = args.cmod,
-                                            duration_infectious=args.doi, infection_rate = args.ir)
-                for _ in range(args.sd):
-                    spread.run()
-                    if spread.terminate:
-                        break
-                # add results to output 
-                res = {'shist': spread.get_history()}
-                output['hist'].append(res)
-                print(f'NI_spread_{file_name}: Source set {count} done.')
+            sources = load_dataset(path)[1]
+            # {args: , graph_u: , hist: [{shist1: }, {shist2: },..., {shist10:}] }
+            if args.batch:
+                tasks = [(cell_path(args, path, args.mode, file_name), run_batch, args, path, file_name)]
+            else:
+                tasks = [(cell_path(args, path, args.mode, file_name, count), run_source, args, path, file_name, count, source) \
+                            for count, source in enumerate(repeat_sources(sources, args.reps), 1)]
             # save output under dirname/data/id.pkl
-            with open(os.path.join(save2, args.id + '.pkl'), 'wb') as f:
-                pickle.dump(output, f)
+            save_file = point_path(args, save2, {})
+            entries.append((file_name, {}, save_file))
+            jobs.append((open_output(args, save_file, path), tasks))
+    write_index(args, os.path.join(args.spath, dirname), entries)
+    run_jobs(jobs, args.workers)
+
+
+def run_source(args, path, file_name, count, source):
+    ''' one source set, returns [{shist: }] '''
+    seed_task(args.seed, args.mode, file_name, count)
+    topo, _, _ = load_dataset(path)
+    G_spread = topo.graph if args.engine == 'nx' else topo  # read-only, shared across source sets
+    # initialization
+    states = {k:'S' for k in topo.nodes.tolist()}
+    states.update({k:'I' for k in source})
+    spread = ENGINES[args.engine](graph = G_spread, states = states, model = args.cmod,
+                                    duration_infectious=args.doi, infection_rate = args.ir)
+    for _ in range(args.sd):
+        spread.run()
+        if spread.terminate:
+            break
+    print(f'NI_spread_{file_name}: Source set {count} done.')
+    return [{'shist': spread.get_history()}]
+
+
+def run_batch(args, path, file_name):
+    ''' all the source sets as the replicas of one ensemble, returns [{shist: }] in replica order '''
+    seed_task(args.seed, args.mode, file_name)
+    topo, sources, _ = load_dataset(path)
+    hist = [{'shist': shist} for shist in run_ensemble(args, topo, sources)]
+    print(f'NI_spread_{file_name}: {len(hist)} replicas done.')
+    return hist
+
+
+def run_ensemble(args, topo, sources):
+    '''
+    Simulate all the source sets, each repeated args.reps times, as the replicas of one
+    EnsembleContagionModel.
+    output:
+        - spread history of each replica, in the order of repeat_sources(sources, args.reps)
+    '''
+    states = []
+    for source in repeat_sources(sources, args.reps):
+        state = {k:'S' for k in topo.nodes.tolist()}
+        state.update({k:'I' for k in source})
+        states.append(state)
+    spread = EnsembleContagionModel(graph = topo, states = states, model = args.cmod,
+                                    duration_infectious=args.doi, infection_rate = args.ir)
+    for _ in range(args.sd):
+        spread.run()
+        if spread.terminate:
+            break
+    return [spread.get_history(r) for r in range(len(states))]
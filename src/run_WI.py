@@ -1,19 +1,30 @@
 import os
-import pickle
 
-from utils import load_data
-from contagion_model import ContagionModel
+import networkx as nx
+
+from utils import repeat_sources
+from contagion_model import ENGINES
 from test_strategy import TestStrategy
 from mitigation_strategy import MitigationStrategy
+from parallel import load_dataset, run_jobs, seed_task
+from sweep import sweep_points, point_path, write_index
+from cache import cell_path
+from results import open_output
 
 
 def run_WI(args):
     print(f'~~~~~~~~~~~ Running in WITH INTERVENTION mode ~~~~~~~~~')
     dirname = f'{args.mode}_{args.cmod}_{args.tmod}_{args.mmod}'
+    if args.mmod == 'commit' and args.nscore != 'B':
+        dirname += f'_{args.nscore}'
+    if args.online and args.mmod in ('commit', 'comiso'):
+        dirname += '_online'
     save2 = os.path.join(args.spath, dirname)
     if not os.path.exists(save2):
         os.makedirs(save2)
-    # loop over data
+    # loop over data, the source sets of all the datasets and parameter values are run as the tasks of one pool
+    points = sweep_points(args)
+    jobs, entries = [], []
     for root, _, files in os.walk(args.dpath):
         for file in files:
             save2 = os.path.join(args.spath, dirname)
@@ -23,101 +34,62 @@ def run_WI(args):
                 os.mkdir(save2)
             path = os.path.join(root, file)
             print(f'############## WI: {file_name} #############')
-            # check multi-value parameters
-            if len(args.mcbud) > 1:
-                save2 = os.path.join(save2, args.id + '_var_mcbud')
-                if not os.path.exists(save2):
-                    os.mkdir(save2)
-                for mcbud in args.mcbud:
-                    output = run(args, mcbud, args.mnbud[0], args.mrd[0], args.cthr[0], args.tbud[0], args.tcer[0], path, file_name)
-                    with open(os.path.join(save2, str(mcbud) + '.pkl'), 'wb') as f:
-                        pickle.dump(output, f)
-            elif len(args.mnbud) > 1:
-                save2 = os.path.join(save2, args.id + '_var_mnbud')
-                if not os.path.exists(save2):
-                    os.mkdir(save2)
-                for mnbud in args.mnbud:
-                    output = run(args, args.mcbud[0], mnbud, args.mrd[0], args.cthr[0], args.tbud[0], args.tcer[0], path, file_name)
-                    with open(os.path.join(save2, str(mnbud) + '.pkl'), 'wb') as f:
-                        pickle.dump(output, f)
-            elif len(args.mrd) > 1:
-                save2 = os.path.join(save2, args.id + '_var_mrd')
-                if not os.path.exists(save2):
-                    os.mkdir(save2)
-                for mrd in args.mrd:
-                    output = run(args, args.mcbud[0], args.mnbud[0], mrd, args.cthr[0], args.tbud[0], args.tcer[0], path, file_name)
-                    with open(os.path.join(save2, str(mrd) + '.pkl'), 'wb') as f:
-                        pickle.dump(output, f)
-            elif len(args.cthr) > 1:
-                save2 = os.path.join(save2, args.id + '_var_cthr')
-                if not os.path.exists(save2):
-                    os.mkdir(save2)
-                for cthr in args.cthr:
-                    output = run(args, args.mcbud[0], args.mnbud[0], args.mrd[0], cthr, args.tbud[0], args.tcer[0], path, file_name)
-                    with open(os.path.join(save2, str(cthr) + '.pkl'), 'wb') as f:
-                        pickle.dump(output, f)
-            elif len(args.tbud) > 1:
-                save2 = os.path.join(save2, args.id + '_var_tbud')
-                if not os.path.exists(save2):
-                    os.mkdir(save2)
-                for tbud in args.tbud:
-                    output = run(args, args.mcbud[0], args.mnbud[0],args.mrd[0], args.cthr[0], tbud, args.tcer[0], path, file_name)
-                    with open(os.path.join(save2, str(tbud) + '.pkl'), 'wb') as f:
-                        pickle.dump(output, f)
-            elif len(args.tcer) > 1:
-                save2 = os.path.join(save2, args.id + '_var_tcer')
-                if not os.path.exists(save2):
-                    os.mkdir(save2)
-                for tcer in args.tcer:
-                    output = run(args, args.mcbud[0], args.mnbud[0], args.mrd[0], args.cthr[0], args.tbud[0], tcer, path, file_name)
-                    with open(os.path.join(save2, str(tcer) + '.pkl'), 'wb') as f:
-                        pickle.dump(output, f)
-            else:  # both are single-value
-                output = run(args, args.mcbud[0], args.mnbud[0], args.mrd[0], args.cthr[0], args.tbud[0], args.tcer[0], path, file_name)
-                with open(os.path.join(save2, args.id + '.pkl'), 'wb') as f:
-                    pickle.dump(output, f)
-
+            # one job per parameter point, the multi-value parameters are swept over their full grid
+            for point in points:
+                save_file = point_path(args, save2, point)
+                entries.append((file_name, point, save_file))
+                jobs.append((open_output(args, save_file, path), job(args, path=path, file_name=file_name, **point)))
+    write_index(args, os.path.join(args.spath, dirname), entries)
+    run_jobs(jobs, args.workers)
 
 
-def run(args, mcbud, mnbud, mrd, cthr, tbud, tcer, path, file_name):      
-    G_u0, G_k0, sources, clusters = load_data(path)
+def job(args, mcbud, mnbud, mrd, cthr, tbud, tcer, path, file_name):
+    ''' the tasks that fill the hist of one dataset and parameter values '''
     # {args: , graph_u: , hist: [{shist1: ,thist1:, mhist1:},..., {shist10, thist10:,, mhist10:}] }
-    output = {'args': vars(args).copy(), 'graph_u': G_u0.copy(), 'hist': []}
-    # loop over sources
-    count = 0
-    for source in sources:
-        count += 1
-        G_u = G_u0.copy()
-        G_k = G_k0.copy()
-        # spread init
-        states = {k:'S' for k in G_u.nodes()}
-        states.update({k:'I' for k in source})
-        spread = ContagionModel(graph = G_u, states = states, model = args.cmod,
+    sources = load_dataset(path)[1]
+    return [(cell_path(args, path, args.mode, file_name, mcbud, mnbud, mrd, cthr, tbud, tcer, count),
+                run_source, args, mcbud, mnbud, mrd, cthr, tbud, tcer, path, file_name, count, source) \
+                for count, source in enumerate(repeat_sources(sources, args.reps), 1)]
+
+
+def run_source(args, mcbud, mnbud, mrd, cthr, tbud, tcer, path, file_name, count, source):
+    ''' one source set, returns [{shist: , thist: , mhist: }] '''
+    seed_task(args.seed, args.mode, file_name, mcbud, mnbud, mrd, cthr, tbud, tcer, count)
+    topo, _, clusters = load_dataset(path)  # topo: shared CSR adjacency, the restrictions of mitigation are masks over it
+    if args.online:  # start from singletons, the communities are found on the known graph
+        clusters = [[n] for n in topo.nodes.tolist()]
+    # the base graph is shared by reference, each component copies (or overlays) what it changes
+    G_k = nx.Graph()  # graph known = the one we fill it up
+    G_k.add_nodes_from(topo.nodes.tolist())
+    G_spread = topo.graph if args.engine == 'nx' else topo  # the networkx graph is only built for the nx engine
+    # spread init
+    states = {k:'S' for k in topo.nodes.tolist()}
+    states.update({k:'I' for k in source})
+    spread = ENGINES[args.engine](graph = G_spread, states = states, model = args.cmod,
                                     duration_infectious=args.doi, infection_rate = args.ir)
-        # test init
-        paramst = dict(visited=[], epsilon=args.eps, rec_pos=[], decay_factor=args.df)
-        budget = int(tbud * G_k.number_of_nodes())
-        test = TestStrategy(method = args.tmod, graph_unknown = G_u, spread_model = spread, graph_known = G_k, 
-                            test_budget = budget, trace_acc = tcer, **paramst)
-        # mitigation init
-        paramsm = dict(restrict_time=mrd, restrict_candidate_budget=int(mcbud * G_k.number_of_nodes()), 
-                        restrict_candidate_neigh_budget=mnbud, community_thr=cthr)
-        mitigate = MitigationStrategy(method = args.mmod, graph_known = G_k, graph_unknown = G_u,
-                                      clusters = clusters, test_states = test.get_states(), **paramsm)
-        for _ in range(args.sd):
-            # test
-            test.run()
-            # mitigate
-            mitigate.set_graph_k(test.get_graph_k())
-            mitigate.run(test.get_states(), test.get_latest_inf())
-            # spread
-            spread.set_graph(mitigate.get_graph_u())
-            spread.run()
-            if spread.terminate:
-                break
-        # add results to output 
-        res = {'shist': spread.get_history(), 'thist': test.get_history(), 'mhist': mitigate.get_history()}
-        output['hist'].append(res)
-        print(f'WI_mcbud{mcbud}_mnbud{mnbud}_mrd{mrd}_cthr{cthr}_tbud{tbud}_tcer{tcer}_{file_name}: Source set {count} done.')
-    return output
-            
+    # test init
+    paramst = dict(visited=[], epsilon=args.eps, rec_pos=[], decay_factor=args.df)
+    budget = int(tbud * G_k.number_of_nodes())
+    test = TestStrategy(method = args.tmod, graph_unknown = topo, spread_model = spread, graph_known = G_k, 
+                        test_budget = budget, trace_acc = tcer, **paramst)
+    # mitigation init
+    paramsm = dict(restrict_time=mrd, restrict_candidate_budget=int(mcbud * G_k.number_of_nodes()), 
+                    restrict_candidate_neigh_budget=mnbud, community_thr=cthr, nscore=args.nscore,
+                    online_coms=args.online)
+    mitigate = MitigationStrategy(method = args.mmod, graph_known = test.get_graph_k(), graph_unknown = topo,
+                                  clusters = clusters, test_states = test.get_states(), **paramsm)
+    # the spread reads the restrictions (edge mask) of mitigation directly from now on
+    spread.set_graph(mitigate.get_graph_u())
+    for _ in range(args.sd):
+        # test
+        test.run()
+        # mitigate
+        mitigate.set_graph_k(test.get_graph_k())
+        mitigate.run(test.get_states(), test.get_latest_inf())
+        # spread
+        spread.run()
+        if spread.terminate:
+            break
+    print(f'WI_mcbud{mcbud}_mnbud{mnbud}_mrd{mrd}_cthr{cthr}_tbud{tbud}_tcer{tcer}_{file_name}: Source set {count} done.')
+    # add results to output 
+    return [{'shist': spread.get_history(), 'thist': test.get_history(), 'mhist': mitigate.get_history()}]
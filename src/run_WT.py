@@ -1,9 +1,15 @@
 import os
-import pickle
 
-from utils import load_data
-from contagion_model import ContagionModel
+import networkx as nx
+
+from utils import repeat_sources
+from contagion_model import ENGINES, ReplayContagionModel
 from test_strategy import TestStrategy
+from run_NI import run_ensemble
+from parallel import load_dataset, run_jobs, seed_task
+from sweep import sweep_points, point_path, write_index
+from cache import cell_path
+from results import open_output
 
 def run_WT(args):
     print(f'~~~~~~~~~~~ Running in WITH TEST mode ~~~~~~~~~')
@@ -11,7 +17,9 @@ def run_WT(args):
     save2 = os.path.join(args.spath, dirname)
     if not os.path.exists(save2):
         os.makedirs(save2)
-    # loop over data
+    # loop over data, the source sets of all the datasets and parameter values are run as the tasks of one pool
+    points = sweep_points(args)
+    jobs, entries = [], []
     for root, _, files in os.walk(args.dpath):
         for file in files:
             save2 = os.path.join(args.spath, dirname)
@@ -21,58 +29,66 @@ def run_WT(args):
                 os.mkdir(save2)
             path = os.path.join(root, file)
             print(f'############## WT: {file_name} #############')
-            # check multi-value parameters
-            if len(args.tbud) > 1:
-                save2 = os.path.join(save2, args.id + '_var_tbud')
-                if not os.path.exists(save2):
-                    os.mkdir(save2)
-                for tbud in args.tbud:
-                    output = run(args, tbud, args.tcer[0], path, file_name)
-                    with open(os.path.join(save2, str(tbud) + '.pkl'), 'wb') as f:
-                        pickle.dump(output, f)
-            elif len(args.tcer) > 1:
-                save2 = os.path.join(save2, args.id + '_var_tcer')
-                if not os.path.exists(save2):
-                    os.mkdir(save2)
-                for tcer in args.tcer:
-                    output = run(args, args.tbud[0], tcer, path, file_name)
-                    with open(os.path.join(save2, str(tcer) + '.pkl'), 'wb') as f:
-                        pickle.dump(output, f)
-            else:  # both are single-value
-                output = run(args, args.tbud[0], args.tcer[0], path, file_name)
-                with open(os.path.join(save2, args.id + '.pkl'), 'wb') as f:
-                    pickle.dump(output, f)
-
+            # one job per parameter point, the multi-value parameters are swept over their full grid
+            for point in points:
+                save_file = point_path(args, save2, point)
+                entries.append((file_name, point, save_file))
+                jobs.append((open_output(args, save_file, path), job(args, path=path, file_name=file_name, **point)))
+    write_index(args, os.path.join(args.spath, dirname), entries)
+    run_jobs(jobs, args.workers)
 
 
-def run(args, tbud, tcer, path, file_name):      
-    G_u0, G_k0, sources, _ = load_data(path)
+def job(args, tbud, tcer, path, file_name):
+    ''' the tasks that fill the hist of one dataset and parameter values '''
     # {args: , graph_u: , hist: [{shist1: ,thist1},..., {shist10, thist10:}] }
-    output = {'args': vars(args).copy(), 'graph_u': G_u0.copy(), 'hist': []}
-    # loop over sources
-    count = 0
-    for source in sources:
-        count += 1
-        G_u = G_u0.copy()
-        G_k = G_k0.copy()
-        # spread init
-        states = {k:'S' for k in G_u.nodes()}
+    sources = load_dataset(path)[1]
+    if args.batch:
+        return [(cell_path(args, path, args.mode, file_name, tbud, tcer),
+                    run_batch, args, tbud, tcer, path, file_name)]
+    return [(cell_path(args, path, args.mode, file_name, tbud, tcer, count),
+                run_source, args, tbud, tcer, path, file_name, count, source, None) \
+                for count, source in enumerate(repeat_sources(sources, args.reps), 1)]
+
+
+def run_batch(args, tbud, tcer, path, file_name):
+    '''
+    the test does not affect the spread, in batch mode all replicas are simulated in one pass
+    and each test then runs on the replay of its replica
+    '''
+    seed_task(args.seed, args.mode, file_name, tbud, tcer)
+    topo, sources, _ = load_dataset(path)
+    shists = run_ensemble(args, topo, sources)
+    return [item for count, (source, shist) in enumerate(zip(repeat_sources(sources, args.reps), shists), 1) \
+                for item in run_source(args, tbud, tcer, path, file_name, count, source, shist)]
+
+
+def run_source(args, tbud, tcer, path, file_name, count, source, shist):
+    ''' one source set (on the replay of shist if given), returns [{shist: , thist: }] '''
+    if shist is None:
+        seed_task(args.seed, args.mode, file_name, tbud, tcer, count)
+    topo, _, _ = load_dataset(path)  # shared CSR adjacency (tracing, and the array-based engines)
+    # the base graph is shared by reference, each component copies (or overlays) what it changes
+    G_k = nx.Graph()  # graph known = the one we fill it up
+    G_k.add_nodes_from(topo.nodes.tolist())
+    G_spread = topo.graph if args.engine == 'nx' else topo  # the networkx graph is only built for the nx engine
+    # spread init
+    if shist is None:
+        states = {k:'S' for k in topo.nodes.tolist()}
         states.update({k:'I' for k in source})
-        spread = ContagionModel(graph = G_u, states = states, model = args.cmod,
-                                    duration_infectious=args.doi, infection_rate = args.ir)
-        # test init
-        params = dict(visited=[], epsilon=args.eps, rec_pos=[], decay_factor=args.df)
-        budget = int(tbud * G_k.number_of_nodes())
-        test = TestStrategy(method = args.tmod, graph_unknown = G_u, spread_model = spread, graph_known = G_k, 
-                            test_budget = budget, trace_acc = tcer, **params)
-        for _ in range(args.sd):
-            test.run()
-            spread.run()
-            if spread.terminate:
-                break
-        # add results to output 
-        res = {'shist': spread.get_history(), 'thist': test.get_history()}
-        output['hist'].append(res)
-        print(f'WT_tbud{tbud}_tcer{tcer}_{file_name}: Source set {count} done.')
-    return output
-            
+        spread = ENGINES[args.engine](graph = G_spread, states = states, model = args.cmod,
+                                        duration_infectious=args.doi, infection_rate = args.ir)
+    else:
+        spread = ReplayContagionModel(shist)
+    # test init
+    params = dict(visited=[], epsilon=args.eps, rec_pos=[], decay_factor=args.df)
+    budget = int(tbud * G_k.number_of_nodes())
+    test = TestStrategy(method = args.tmod, graph_unknown = topo, spread_model = spread, graph_known = G_k, 
+                        test_budget = budget, trace_acc = tcer, **params)
+    for _ in range(args.sd):
+        test.run()
+        spread.run()
+        if spread.terminate:
+            break
+    print(f'WT_tbud{tbud}_tcer{tcer}_{file_name}: Source set {count} done.')
+    # add results to output 
+    return [{'shist': spread.get_history(), 'thist': test.get_history()}]
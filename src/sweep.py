@@ -0,0 +1,65 @@
+import itertools
+import json
+import os
+
+# the multi-value parameters of each mode, in the order they are passed to its job
+SWEEP_PARAMS = {'NI': [],
+                'WT': ['tbud', 'tcer'],
+                'WI': ['mcbud', 'mnbud', 'mrd', 'cthr', 'tbud', 'tcer']}
+
+
+def sweep_points(args):
+    '''
+    output:
+        - the parameter points to run, [{parameter: value}]: the points of args.points if given
+          (the parameters they leave out take their first value), else the full grid of the values
+          of the multi-value parameters
+    '''
+    names = SWEEP_PARAMS[args.mode]
+    if args.points:
+        with open(args.points) as f:
+            points = json.load(f)
+        for point in points:
+            unknown = set(point) - set(names)
+            if unknown:
+                raise ValueError(f'Parameters {sorted(unknown)} can not be swept in {args.mode} mode.')
+        return [{name: point.get(name, getattr(args, name)[0]) for name in names} for point in points]
+    return [dict(zip(names, values)) for values in itertools.product(*[getattr(args, name) for name in names])]
+
+
+def point_path(args, save2, point):
+    '''
+    input:
+        - save2: directory of the dataset results
+        - point: {parameter: value}
+    output:
+        - file of the point: save2/id.pkl if no parameter is multi-value, save2/id_var_<parameter>/<value>.pkl
+          if only one of them is, else save2/id_sweep/<parameter><value>_..._<parameter><value>.pkl
+          (.res instead of .pkl in the chunked format)
+    '''
+    ext = '.pkl' if args.format == 'pkl' else '.res'  # a pickle or a ResultWriter directory
+    multi = [name for name in SWEEP_PARAMS[args.mode] if len(getattr(args, name)) > 1]
+    if not args.points and not multi:
+        return os.path.join(save2, args.id + ext)
+    if not args.points and len(multi) == 1:
+        save2 = os.path.join(save2, args.id + '_var_' + multi[0])
+        name = str(point[multi[0]])
+    else:
+        save2 = os.path.join(save2, args.id + '_sweep')
+        name = '_'.join(f'{k}{v}' for k,v in point.items())
+    if not os.path.exists(save2):
+        os.mkdir(save2)
+    return os.path.join(save2, name + ext)
+
+
+def write_index(args, save2, entries):
+    '''
+    input:
+        - save2: directory of the mode results (spath/dirname)
+        - entries: [(dataset, point, file)]
+    Saves save2/id_index.json: [{dataset: , params: {parameter: value}, file: path relative to save2}]
+    '''
+    index = [{'dataset': dataset, 'params': point, 'file': os.path.relpath(path, save2)} \
+                for dataset, point, path in entries]
+    with open(os.path.join(save2, args.id + '_index.json'), 'w') as f:
+        json.dump(index, f, indent=1)
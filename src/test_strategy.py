@@ -6,21 +6,79 @@ TODO:
 import numpy as np
 from collections import Counter
 
+from graph_state import GraphState, KnownGraph
+from history import LatestStates, TestHistory
+
+class CandidatePool():
+    '''
+    Swap-remove array of node indices: the candidates are pool[:size] and the excluded nodes
+    are moved behind them, so excluding nodes, restoring all of them or drawing k candidates
+    costs O(k), not O(number of nodes).
+    '''
+    def __init__(self, num_nodes):
+        self.pool = np.arange(num_nodes)  # node indices, pool[:size] are the candidates
+        self.pos = np.arange(num_nodes)  # {node_index: position in pool}
+        self.size = num_nodes
+
+    def restore(self):
+        self.size = len(self.pool)
+
+    def exclude(self, rows):
+        ''' rows: node indices to move out of the candidates '''
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        rows = rows[self.pos[rows] < self.size]
+        start = self.size - len(rows)  # the excluded nodes go to pool[start:size]
+        out = rows[self.pos[rows] < start]
+        tail = self.pool[start:self.size]
+        back = tail[~np.isin(tail, rows)]  # candidates that are in the way, same number as out
+        pos_out, pos_back = self.pos[out], self.pos[back]
+        self.pool[pos_out], self.pool[pos_back] = back, out
+        self.pos[back], self.pos[out] = pos_out, pos_back
+        self.size = start
+
+    def members(self):
+        return self.pool[:self.size]
+
+    def sample(self, k):
+        ''' k candidates drawn at random without replacement (all of them if there are not more than k) '''
+        if k >= self.size:
+            return self.pool[:self.size].copy()
+        if 2*k > self.size:
+            return self.pool[np.random.permutation(self.size)[:k]]
+        idx = np.zeros(0, dtype=np.int64)
+        while len(idx) < k:  # draw with replacement, keep the first occurrence of each
+            idx = np.concatenate([idx, np.random.randint(0, self.size, 2*(k - len(idx)))])
+            _, first = np.unique(idx, return_index=True)
+            idx = idx[np.sort(first)]
+        return self.pool[idx[:k]]
+
+
 class TestStrategy():
     def __init__(self, method, graph_unknown, spread_model, graph_known, test_budget, 
                  trace_acc, history_enable=True, **parameters):
         # immutable
         self.method = method  # the testing strategy name
-        self.graph_u = graph_unknown.copy()  # the original graph that is unknown and to be learned via testing
+        if not isinstance(graph_unknown, GraphState):
+            graph_unknown = GraphState(graph_unknown)
+        self.topo = graph_unknown  # CSR adjacency of graph_u, for tracing. Read-only, shared
+        self.graph_u = graph_unknown  # the original graph that is unknown and to be learned via testing (GraphState). Read-only, shared
         self.spread = spread_model  # the spread model that is operating on the original graph, contains node state
         self.history_flag = history_enable
         self.budget = test_budget  # in terms of number of nodes that can be tested in each run of test
         self.trace_acc = trace_acc  # 0<  <1. The proportion of neighbors a node reports.
         
         # mutable
-        self.graph_k = graph_known.copy()  # the graph that we are going know and update via the test strategy
-        self.history = []  # [([nodes_tested],[their_states], g_k info: {num_nodes: , num_edges: , {degree: count}})]
+        self.graph_k = KnownGraph(graph_known)  # the graph that we are going know and update via the test strategy (own copy, the only writer)
+        self.graph_k.pop_hist_delta()
+        self.pool = CandidatePool(self.topo.number_of_nodes())  # nodes not visited at t-1, for the strategies with memory
+        self.known = np.zeros(self.topo.number_of_edges(), dtype=bool)  # {edge_id of graph_u: already in graph_k}
+        for u,v in self.graph_k.edges():
+            if u in self.topo.index and v in self.topo.index and self.graph_u.has_edge(u, v):
+                self.known[self.topo.edge_id(u, v)] = True
+        self.history = TestHistory(list(self.graph_k.nodes()), self.graph_k.get_deg_dist())  # compact [([nodes_tested],[their_states], g_k info)]
         self.current_results = ()  # ([nodes_tested],[their_states], g_k info: {num_nodes: , num_edges: , {degree: count}})) at current time
+        self.latest = LatestStates()  # {node: latest test result}, kept up to date (and its changes logged) in update
+        self.timeline = {}  # {node: [test results over time]}, appended in update
         self.params = parameters  # dict of test-specific parameters
         # {visited:[]} for random_wMemory
         # {epsilon: , rec_pos:[], decay_factor:} for epsilon greedy, rec_pos is positively tested in last test,
@@ -43,21 +101,37 @@ class TestStrategy():
             raise ValueError(f'The test strategy {self.method} is not supported.')
             
     def update(self, nodes_tested):
-        test_results = np.asarray([self.spread.get_states()[k] for k in nodes_tested])
-        # pickle neighbors randomly using self.trace_acc
-        edges_collected = np.asarray([(node,neigh) for node in nodes_tested for \
-                                      neigh in np.random.choice(list(self.graph_u.neighbors(node)), \
-                                                                int(self.graph_u.degree(node)*self.trace_acc), \
-                                                                replace=False)])
-        self.graph_k.add_edges_from(edges_collected)
+        test_results = np.asarray(self.spread.get_node_states(nodes_tested))
+        # pickle neighbors randomly using self.trace_acc, for all the tested nodes at once
+        rows = np.asarray([self.topo.index[n] for n in np.asarray(nodes_tested).tolist()], dtype=np.int64)
+        owner, slots = self.topo.sample_slots(rows, self.trace_acc)
+        # keep only the edges that are not known yet (each once)
+        eids = self.topo.eid[slots]
+        new = np.flatnonzero(~self.known[eids])
+        _, first = np.unique(eids[new], return_index=True)
+        new = new[np.sort(first)]
+        self.known[eids[new]] = True
+        edges_collected = self.topo.nodes[np.stack([rows[owner[new]], self.topo.indices[slots[new]]], axis=1)]
+        self.graph_k.add_edges_from(edges_collected.tolist())
         self.current_results = (nodes_tested, test_results, self.get_graph_info(self.graph_k))
+        deg_delta = self.graph_k.pop_hist_delta()
         if self.history_flag:
-            self.history.append(self.current_results)
+            self.history.record(nodes_tested, test_results, self.graph_k.num_edges, deg_delta)
+            for node, state in zip(nodes_tested.tolist(), test_results.tolist()):
+                self.latest[node] = state
+                self.timeline.setdefault(node, []).append(state)
             
     def get_graph_info(self, graph):
+        if isinstance(graph, KnownGraph):  # kept up to date as edges are added
+            return dict(num_edges = graph.num_edges, deg_dist = graph.get_deg_dist())
         return dict(num_edges = graph.number_of_edges(),
                    deg_dist = dict(Counter(dict(graph.degree()).values())))
     
+    def set_visited(self, visited):
+        ''' exclude the nodes visited at t-1 (and only them) from the candidate pool '''
+        self.pool.restore()
+        self.pool.exclude([self.topo.index[n] for n in visited.tolist()])
+
     def random(self):
         ''' Choose nodes at random. '''
         nodes_tested = np.random.choice(self.graph_k, self.budget, replace = False)
@@ -68,11 +142,8 @@ class TestStrategy():
         if not isinstance(self.params['visited'], np.ndarray):
             self.params['visited'] = np.asarray(self.params['visited'])
         visited = self.params['visited']
-        candidates = list(set(list(self.graph_u.nodes())) ^ set(visited))
-        if len(candidates) <= self.budget:
-            nodes_tested = np.asarray(candidates)
-        else:
-            nodes_tested = np.random.choice(candidates, self.budget, replace = False)
+        self.set_visited(visited)
+        nodes_tested = self.topo.nodes[self.pool.sample(self.budget)]
         self.update(nodes_tested)
         self.params['visited'] = nodes_tested
 
@@ -81,9 +152,7 @@ class TestStrategy():
         if not isinstance(self.params['visited'], np.ndarray):
             self.params['visited'] = np.asarray(self.params['visited'])
         visited = self.params['visited']
-        candidates = list(set(list(self.graph_u.nodes())) ^ set(visited))
-        sort_cand = sorted(candidates, key=lambda x: self.graph_k.degree(x), reverse=True)  # descending
-        nodes_tested = np.asarray(sort_cand[:self.budget])
+        nodes_tested = np.asarray(self.graph_k.top_by_degree(self.budget, set(visited.tolist())))  # descending
         self.update(nodes_tested)
         self.params['visited'] = nodes_tested
         
@@ -100,7 +169,7 @@ class TestStrategy():
             pivots = np.random.choice(rec_pos, len(probs)-len(p_eps), replace=False)
         candidates = np.asarray(list(set([np.random.choice(list(self.graph_u.neighbors(node))) for node in pivots])))
         # add random actions (randomly choose a node to test)
-        nodes_tested = np.random.choice(self.graph_u.nodes(), len(probs)-len(candidates), replace = False)
+        nodes_tested = np.random.choice(self.topo.nodes.tolist(), len(probs)-len(candidates), replace = False)
         nodes_tested = np.append(nodes_tested, candidates)
         self.update(nodes_tested)
         # self.params['epsilon'] = epsilon * (1/self.params['decay_factor'])
@@ -125,11 +194,8 @@ class TestStrategy():
             pivots = np.random.choice(rec_pos, len(probs)-len(p_eps), replace=False)
         candidates = np.asarray(list(set([np.random.choice(list(self.graph_u.neighbors(node))) for node in pivots])))
         # add random actions (randomly choose a node to test) -- ad it with memory
-        not_visited = list(set(list(self.graph_u.nodes())) ^ set(visited))
-        if len(not_visited) <= len(probs)-len(candidates):
-            nodes_tested = np.asarray(not_visited)
-        else:
-            nodes_tested = np.random.choice(not_visited, len(probs)-len(candidates), replace = False)
+        self.set_visited(visited)
+        nodes_tested = self.topo.nodes[self.pool.sample(len(probs)-len(candidates))]
         nodes_tested = np.append(nodes_tested, candidates)
         self.update(nodes_tested)
         # self.params['epsilon'] = epsilon * (1/self.params['decay_factor'])
@@ -153,9 +219,7 @@ class TestStrategy():
         pivots = rec_pos[:len(probs)-len(p_eps)]
         candidates = np.asarray(list(set([np.random.choice(list(self.graph_u.neighbors(node))) for node in pivots])))
         # add random actions (choose a node to test by known degree) -- with memory
-        not_visited = list(set(list(self.graph_u.nodes())) ^ set(visited))
-        not_visited = sorted(not_visited, key=lambda x: self.graph_k.degree(x), reverse= True)
-        nodes_tested = np.asarray(not_visited[:len(probs)-len(candidates)])
+        nodes_tested = np.asarray(self.graph_k.top_by_degree(len(probs)-len(candidates), set(visited.tolist())))
         nodes_tested = np.append(nodes_tested, candidates)
         self.update(nodes_tested)
         # self.params['epsilon'] = epsilon * (1/self.params['decay_factor'])
@@ -182,18 +246,15 @@ class TestStrategy():
         return settings
 
     def get_states(self, mode='latest'):
-        # from history, infer the latest state of the nodes
+        # the latest state of the nodes (or all their test results) inferred from the tests so far
         if not self.history_flag and mode != 'latest':
             return ValueError(f'Cannot get states in mode {mode} when history is not activated for testing.')
         elif not self.history_flag:
             return {i[0]:i[1] for i in zip(self.current_results[0], self.current_results[1])}
-        states = {}
-        for item in self.history:
-            for k in zip(item[0], item[1]):  # nodes: states
-                states.setdefault(k[0], []).append(k[1])
+        # maintained in update, read-only for the caller
         if mode == 'latest':
-            return {k:v[-1] for k,v in states.items()}
-        return states
+            return self.latest
+        return self.timeline
 
     def get_latest_inf(self):
         return [i for i,j in zip(self.current_results[0], self.current_results[1]) if j =='I']
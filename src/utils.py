@@ -1,8 +1,13 @@
+import os
+import shutil
 import numpy as np
 import pickle
 from collections import Counter
 import networkx as nx
 
+from graph_state import GraphState
+from history import SpreadHistory, RestrictionHistory, TestHistory
+
 def load_data(path):
     with open(path, 'rb') as f:
         data = pickle.load(f)
@@ -14,11 +19,73 @@ def load_data(path):
     return G_u, G_k, sources, clusters
 
 
+def data_cache_dir(path):
+    ''' directory of the binary cache of a dataset file: <data directory>_cache/<name>_<size>_<mtime> '''
+    stat = os.stat(path)
+    root, file = os.path.split(os.path.abspath(path))
+    return os.path.join(root + '_cache', f'{file.split(".pkl")[0]}_{stat.st_size}_{stat.st_mtime_ns}')
+
+
+def cache_data(path, directory):
+    '''
+    one-time conversion of a dataset file into .npy files in directory: the CSR adjacency with the
+    nodes as contiguous int32 ids (see GraphState.save), the members of each community in their
+    order and the source sets as node ids
+    '''
+    G_u, _, sources, clusters = load_data(path)
+    topo = GraphState(G_u)
+    tmp = f'{directory}.{os.getpid()}.tmp'
+    os.makedirs(tmp, exist_ok=True)
+    topo.save(tmp)
+    members = np.asarray([topo.index[n] for c in clusters for n in c], dtype=np.int32)
+    arrays = dict(members=members, com_offsets=np.cumsum([0] + [len(c) for c in clusters]),
+                  sources=np.asarray([topo.index[n] for s in sources for n in np.asarray(s).tolist()], dtype=np.int32),
+                  source_offsets=np.cumsum([0] + [len(s) for s in sources]))
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp, name + '.npy'), array)
+    try:
+        os.replace(tmp, directory)
+    except OSError:  # converted by another process meanwhile
+        shutil.rmtree(tmp)
+
+
+def load_data_cached(path):
+    '''
+    input:
+        - path: dataset file, converted into its binary cache on first use (see cache_data)
+    output:
+        - topo: GraphState over the memory-mapped arrays (the networkx graph is built on first use)
+        - sources: list of source sets (arrays of nodes)
+        - clusters: list of communities (lists of nodes)
+    '''
+    directory = data_cache_dir(path)
+    if not os.path.exists(directory):
+        cache_data(path, directory)
+    topo = GraphState.load(directory)
+    load = lambda name: np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+    sources, source_offsets = load('sources'), load('source_offsets')
+    members, com_offsets = load('members'), load('com_offsets')
+    sources = [topo.nodes[sources[a:b]] for a,b in zip(source_offsets[:-1], source_offsets[1:])]
+    clusters = [topo.nodes[members[a:b]].tolist() for a,b in zip(com_offsets[:-1], com_offsets[1:])]
+    return topo, sources, clusters
+
+
+def repeat_sources(sources, reps):
+    '''
+    input:
+        - sources: list of source sets
+        - reps: number of Monte-Carlo repeats of each source set
+    output:
+        - list of source sets with each one repeated reps times (in order)
+    '''
+    return [source for source in sources for _ in range(reps)]
+
+
 # mit metric 
 def calc_mit_metric(mhist, graph):
     '''
     input: 
-        - mitigation history: [{node: Y or N}], len = #runs of mit + 1
+        - mitigation history: RestrictionHistory or [{node: Y or N}], len = #runs of mit + 1
         - graph: orginal graph 
     output: 
         - number of nodes in the restricted zone ('Y' state) at each time (new and old)/total number of graph nodes
@@ -27,25 +94,35 @@ def calc_mit_metric(mhist, graph):
     num_nodes = graph.number_of_nodes()
     if num_nodes == 0: 
         raise ValueError('The input graph is empty!')
+    if isinstance(mhist, RestrictionHistory):  # straight from the restriction intervals
+        return mhist.restricted_counts()/num_nodes
     return np.asarray([len([k for k,v in item.items() if v == 'Y'])/num_nodes for item in mhist])
 
 # test metric
 def calc_test_metric(thist, shist):
     '''
     input: 
-        - test history: [([nodes],[states],{graph info})], len = #runs of test
-        - spread history: # [{node: SIR}], len = #runs of spread + 1
+        - test history: TestHistory or [([nodes],[states],{graph info})], len = #runs of test
+        - spread history: # SpreadHistory or [{node: SIR}], len = #runs of spread + 1
         Note: since test is called before spread in pipeline, the last thist item is for shist[-2]
     output: 
         - efficiency: [test_inf/test_budget], len = #runs of test
         - efficacy: [test_inf/all_inf], len = #runs of test (or len shist - 1)
     '''
-    efficiency = [dict(Counter(obs[1])).get('I', 0)/len(obs[0]) for obs in thist]
+    if isinstance(thist, TestHistory):  # straight from the result arrays
+        test_pos = thist.positives()
+        efficiency = test_pos/thist.sizes()
+    else:
+        test_pos = [dict(Counter(obs[1])).get('I', 0) for obs in thist]
+        efficiency = [pos/len(obs[0]) for pos,obs in zip(test_pos, thist)]
     efficacy = []
-    for tst,spr in zip(thist,shist[:-1]):
-        tot_pos = dict(Counter(list(spr.values()))).get('I')
+    if isinstance(shist, SpreadHistory):
+        all_pos = shist.counts('I')[:-1]
+    else:
+        all_pos = [dict(Counter(list(spr.values()))).get('I') for spr in shist[:-1]]
+    for pos,tot_pos in zip(test_pos,all_pos):
         if tot_pos > 0:
-            efficacy.append(dict(Counter(tst[1])).get('I', 0)/tot_pos)
+            efficacy.append(pos/tot_pos)
         else:
             efficacy.append(0)
     return {'efficiency': np.asarray(efficiency), 'efficacy': np.asarray(efficacy)}
@@ -54,7 +131,7 @@ def calc_test_metric(thist, shist):
 def calc_spread_metric(shist, graph):
     '''
     input:
-        - spread history: # [{node: SIR}], len = #runs of spread + 1
+        - spread history: # SpreadHistory or [{node: SIR}], len = #runs of spread + 1
         - graph: orginal graph 
     output:
         - new_inf: [#new_inf/#graph_nodes], len = #runs of spread + 1
@@ -64,9 +141,12 @@ def calc_spread_metric(shist, graph):
     num_nodes = graph.number_of_nodes()
     if num_nodes == 0: 
         raise ValueError('The input graph is empty!')
-    new_inf = [len([node for node,state in shist[0].items() if state == 'I'])]
-    new_inf = np.asarray(new_inf + [len([node for node,state in shist[idx].items() \
-               if state == 'I' and shist[idx-1][node] != 'I']) for idx in range(1, len(shist))])/num_nodes
+    if isinstance(shist, SpreadHistory):  # straight from the change log
+        new_inf = shist.new_infections()/num_nodes
+    else:
+        new_inf = [len([node for node,state in shist[0].items() if state == 'I'])]
+        new_inf = np.asarray(new_inf + [len([node for node,state in shist[idx].items() \
+                   if state == 'I' and shist[idx-1][node] != 'I']) for idx in range(1, len(shist))])/num_nodes
     duration = len(shist)
     if duration == 0: 
         raise ValueError('The input history for spread is empty!')
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules of src import each other as top-level modules (the scripts are run from src)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
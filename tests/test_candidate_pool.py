@@ -0,0 +1,40 @@
+import numpy as np
+
+from test_strategy import CandidatePool
+
+
+def check_pool(pool, excluded):
+    members = pool.members()
+    assert sorted(members.tolist()) == sorted(set(range(len(pool.pool))) - set(excluded))
+    assert (pool.pos[pool.pool] == np.arange(len(pool.pool))).all()  # pos stays the inverse of pool
+
+
+def test_candidate_pool_never_returns_previous_batch():
+    # like TestStrategy.set_visited: every round excludes exactly the batch drawn the round before
+    np.random.seed(0)
+    num_nodes = 200
+    pool = CandidatePool(num_nodes)
+    previous = np.zeros(0, dtype=np.int64)
+    for k in [1, 5, 30, 99, 100, 101, 150, 200, 7] * 5:
+        pool.restore()
+        pool.exclude(np.concatenate([previous, previous[:3]]))  # duplicates are ignored
+        check_pool(pool, previous.tolist())
+        batch = pool.sample(k)
+        assert len(batch) == min(k, num_nodes - len(previous))
+        assert len(set(batch.tolist())) == len(batch)
+        assert not set(batch.tolist()) & set(previous.tolist())
+        previous = batch
+
+
+def test_candidate_pool_exclude_accumulates():
+    np.random.seed(1)
+    pool = CandidatePool(50)
+    excluded = set()
+    for _ in range(12):
+        rows = np.random.randint(0, 50, 6)
+        pool.exclude(rows)
+        excluded |= set(rows.tolist())
+        check_pool(pool, excluded)
+        assert not set(pool.sample(10).tolist()) & excluded
+    pool.restore()
+    check_pool(pool, [])
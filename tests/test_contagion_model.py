@@ -0,0 +1,63 @@
+import networkx as nx
+import numpy as np
+import pytest
+
+from contagion_model import ContagionModel, CSRContagionModel, EventContagionModel
+from graph_state import GraphState, RestrictionOverlay
+
+
+def spread(engine, graph, model, steps, **kwargs):
+    nodes = graph.nodes.tolist() if isinstance(graph, GraphState) else list(graph)
+    states = {n: 'S' for n in nodes}
+    states.update({0: 'I', 17: 'I'})
+    sim = engine(graph, states, model, 3, 1.0, **kwargs)
+    for _ in range(steps):
+        sim.run()
+    return list(sim.get_history())
+
+
+@pytest.mark.parametrize('model', ['SIR', 'SIS'])
+@pytest.mark.parametrize('kernel', ['push', 'pull', 'auto'])
+def test_csr_engine_matches_nx_engine(model, kernel):
+    # with infection_rate 1 the spread is deterministic, so the histories are the same
+    g = nx.gnm_random_graph(60, 150, seed=3)
+    expected = spread(ContagionModel, g, model, 12)
+    assert spread(CSRContagionModel, g, model, 12, kernel=kernel) == expected
+    assert spread(CSRContagionModel, GraphState(g), model, 12, kernel=kernel) == expected
+
+
+@pytest.mark.parametrize('model', ['SIR', 'SIS'])
+def test_csr_engine_final_size_matches_nx_engine(model):
+    g = nx.gnm_random_graph(200, 600, seed=5)
+    sizes = {}
+    for engine in (ContagionModel, CSRContagionModel):
+        np.random.seed(0)
+        runs = []
+        for _ in range(30):
+            states = {n: 'S' for n in g}
+            states[0] = 'I'
+            sim = engine(g, states, model, 3, 0.3)
+            for _ in range(15):
+                sim.run()
+            runs.append(sim.get_history().counts('I' if model == 'SIS' else 'R')[-1])
+        sizes[engine] = np.mean(runs)
+    assert sizes[CSRContagionModel] == pytest.approx(sizes[ContagionModel], rel=0.15)
+
+
+def test_event_model_masked_edge_certain_infection():
+    # with infection_rate 1 the retries over a removed edge must not stay at the current time
+    g = nx.path_graph(3)
+    overlay = RestrictionOverlay(GraphState(g))
+    overlay.remove_edges_from([(0, 1)])
+    model = EventContagionModel(overlay, {0: 'I', 1: 'S', 2: 'S'}, 'SIR', 5, 1.0)
+    for _ in range(2):
+        model.run()
+    assert model.get_node_states([1, 2]) == ['S', 'S']
+    overlay.add_edges_from([(0, 1)])
+    model.set_graph(overlay)
+    model.run()
+    assert model.get_node_states([1]) == ['I']
+    for _ in range(10):
+        model.run()
+    assert model.terminate
+    assert model.get_states() == {0: 'R', 1: 'R', 2: 'R'}
@@ -0,0 +1,56 @@
+import random
+from collections import Counter
+
+import networkx as nx
+
+from graph_state import KnownGraph
+
+
+def random_known_graph(seed, num_nodes=40, steps=1500):
+    ''' KnownGraph after random edge additions and removals (self loops included) and node removals '''
+    rng = random.Random(seed)
+    graph = KnownGraph()
+    graph.add_nodes_from(range(num_nodes))
+    for step in range(steps):
+        u, v = rng.randrange(num_nodes), rng.randrange(num_nodes)
+        if rng.random() < 0.6:
+            graph.add_edges_from([(u, v)])
+        else:
+            graph.remove_edges_from([(u, v)])
+        if step % 300 == 299:
+            n = rng.choice(list(graph))
+            graph.remove_node(n)
+            graph.add_node(n)
+        yield graph
+
+
+def test_known_graph_degree_histogram():
+    previous = [0]
+    for graph in random_known_graph(0):
+        hist = nx.degree_histogram(graph)
+        assert graph.get_deg_dist() == {d: c for d,c in enumerate(hist) if c}
+        assert graph.number_of_edges() == graph.num_edges == nx.Graph(graph).number_of_edges()
+        change = Counter(dict(enumerate(hist)))
+        change.subtract(dict(enumerate(previous)))
+        assert graph.pop_hist_delta() == {d: c for d,c in change.items() if c}
+        previous = hist
+    assert graph.top_by_degree(10) == sorted(graph, key=graph.degree, reverse=True)[:10]
+    part = list(graph)[:15]  # views do not keep num_edges
+    assert graph.subgraph(part).number_of_edges() == nx.Graph(graph).subgraph(part).number_of_edges()
+
+
+def test_known_graph_tuple_nodes():
+    graph = KnownGraph()
+    graph.add_nodes_from([(1, 2), (3, 4), ((5, 6), {'color': 'red'}), 7])
+    assert list(graph) == [(1, 2), (3, 4), (5, 6), 7]
+    assert graph.nodes[(5, 6)] == {'color': 'red'}
+    assert graph.get_deg_dist() == {0: 4}
+
+
+def test_known_graph_triangles_and_neighbor_degrees():
+    # self loops are left out of both counts
+    for graph in random_known_graph(1, steps=800):
+        simple = nx.Graph(graph)
+        simple.remove_edges_from(nx.selfloop_edges(simple))
+        assert graph.triangles == nx.triangles(simple)
+        assert graph.nbr_degree == {n: sum(simple.degree(w) for w in simple[n]) for n in simple}
@@ -0,0 +1,82 @@
+import pickle
+
+import networkx as nx
+import numpy as np
+
+from history import RestrictionHistory, SpreadHistory
+from utils import calc_mit_metric, calc_spread_metric
+
+
+def random_spread(num_nodes=40, steps=25, seed=0):
+    ''' [{node: state}] of a random walk over the states, some nodes change at every time '''
+    rng = np.random.default_rng(seed)
+    nodes = rng.permutation(1000)[:num_nodes].tolist()
+    states = dict(zip(nodes, rng.choice(['S', 'I', 'R'], num_nodes).tolist()))
+    dicts = [states.copy()]
+    for _ in range(steps):
+        for n in rng.choice(nodes, rng.integers(0, num_nodes//2), replace=False).tolist():
+            states[n] = str(rng.choice(['S', 'I', 'R']))
+        dicts.append(states.copy())
+    return nodes, dicts
+
+
+def test_spread_history_matches_list_of_dicts():
+    nodes, dicts = random_spread()
+    hist = SpreadHistory(nodes, dicts[0])
+    for prev, states in zip(dicts[:-1], dicts[1:]):
+        hist.record_states({n: s for n,s in states.items() if prev[n] != s or n % 3 == 0})  # unchanged ones too
+    assert len(hist) == len(dicts)
+    assert list(hist) == dicts
+    assert [hist[t] for t in (3, 0, 7, 7, -1, -len(dicts))] == [dicts[t] for t in (3, 0, 7, 7, -1, -len(dicts))]
+    assert hist[2:9:3] == dicts[2:9:3]
+    for state in 'SIR':
+        assert hist.counts(state).tolist() == [sum(s == state for s in d.values()) for d in dicts]
+    expected = [sum(s == 'I' for s in dicts[0].values())] + \
+               [sum(s == 'I' and prev[n] != 'I' for n,s in d.items()) for prev, d in zip(dicts[:-1], dicts[1:])]
+    assert hist.new_infections().tolist() == expected
+    graph = nx.empty_graph(nodes)
+    compact, old = calc_spread_metric(hist, graph), calc_spread_metric(dicts, graph)
+    assert np.allclose(compact['new_inf'], old['new_inf']) and compact['duration'] == old['duration']
+
+
+def test_spread_history_record_array_and_pickle():
+    nodes, dicts = random_spread(seed=1)
+    codes = {'S': 0, 'I': 1, 'R': 2}
+    hist = SpreadHistory(nodes, np.asarray([codes[dicts[0][n]] for n in nodes]))
+    for states in dicts[1:]:
+        hist.record_array(np.asarray([codes[states[n]] for n in nodes], dtype=np.int8))
+    loaded = pickle.loads(pickle.dumps(hist))
+    assert list(loaded) == dicts
+    assert (loaded.state_matrix() == hist.state_matrix()).all()
+    loaded.record_states({nodes[0]: 'I'})
+    assert loaded[-1] == {**dicts[-1], nodes[0]: 'I'}
+
+
+def test_restriction_history_matches_per_step_dicts():
+    # like MitigationStrategy.set_state: a node can change several times within a step
+    rng = np.random.default_rng(2)
+    nodes = rng.permutation(500)[:30].tolist()
+    state = dict(zip(nodes, rng.choice(['Y', 'N'], len(nodes), p=[0.2, 0.8]).tolist()))
+    hist = RestrictionHistory(state)
+    dicts = [state.copy()]
+    for _ in range(40):
+        for _ in range(rng.integers(0, 4)):
+            new = str(rng.choice(['Y', 'N']))
+            group = rng.choice(nodes, rng.integers(1, 8), replace=False).tolist()
+            changed = [n for n in group if state[n] != new]
+            state.update(dict.fromkeys(group, new))
+            if new == 'Y':
+                hist.restrict(changed)
+            else:
+                hist.release(changed)
+        hist.step()
+        dicts.append(state.copy())
+    assert len(hist) == len(dicts)
+    assert list(hist) == dicts
+    assert hist[-3] == dicts[-3] and hist[5:12] == dicts[5:12]
+    assert hist.restricted_counts().tolist() == [sum(s == 'Y' for s in d.values()) for d in dicts]
+    graph = nx.empty_graph(nodes)
+    assert np.allclose(calc_mit_metric(hist, graph), calc_mit_metric(dicts, graph))
+    loaded = pickle.loads(pickle.dumps(hist))
+    assert list(loaded) == dicts
+    assert loaded.restricted_counts().tolist() == hist.restricted_counts().tolist()
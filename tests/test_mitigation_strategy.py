@@ -0,0 +1,29 @@
+import random
+
+from mitigation_strategy import TimerWheel
+
+
+def test_timer_wheel_matches_countdown():
+    # the countdown of the original strategies: every step all the times go down by one and
+    # the items below 1 run out
+    rng = random.Random(0)
+    wheel, countdown = TimerWheel(), {}
+    for _ in range(500):
+        for _ in range(rng.randrange(4)):
+            item, time = rng.randrange(30), rng.randrange(0, 7)
+            if rng.random() < 0.7:
+                wheel[item] = time
+                countdown[item] = time
+            else:
+                assert wheel.pop(item) == (None if item not in countdown else max(countdown.pop(item), 1))
+        if rng.random() < 0.2:
+            timers = {rng.randrange(30): rng.randrange(1, 5) for _ in range(3)}
+            wheel.update(timers)
+            countdown.update(timers)
+        countdown = {k: v - 1 for k,v in countdown.items()}
+        out = [k for k,v in countdown.items() if v < 1]
+        for k in out:
+            countdown.pop(k)
+        assert sorted(wheel.tick()) == sorted(out)
+        assert sorted(wheel) == sorted(countdown) and len(wheel) == len(countdown)
+        assert all(item in wheel and wheel[item] == max(time, 1) for item, time in countdown.items())